@@ -1,8 +1,14 @@
+import asyncio
 import logging
 import json
+import os
+import time
+import numpy as np
 import uvicorn
 import aiohttp
 
+from fetch_metrics import Histogram
+
 class HTTPStatus:
     """Класс для хранения HTTP статус-кодов"""
     OK_200 = 200
@@ -17,6 +23,7 @@ class HTTPStatus:
     METHOD_NOT_ALLOWED_405 = 405
     CONFLICT_409 = 409
     UNPROCESSABLE_ENTITY_422 = 422
+    PAYLOAD_TOO_LARGE_413 = 413
     TOO_MANY_REQUESTS_429 = 429
     
     INTERNAL_SERVER_ERROR_500 = 500
@@ -36,14 +43,301 @@ logging.basicConfig(
 logger = logging.getLogger(__name__)
 session = None
 
-async def send_complete_response(status:int, body:str, send):
+UPSTREAM_URL = os.environ.get("RATES_UPSTREAM_URL", "https://api.exchangerate-api.com/v4/latest/{currency}")
+# Курсы обновляются раз в несколько минут: свежий ответ отдаётся из кэша CACHE_TTL секунд,
+# ещё STALE_TTL секунд отдаётся устаревший, пока в фоне идёт обновление
+CACHE_TTL = float(os.environ.get("RATES_CACHE_TTL", 300))
+STALE_TTL = float(os.environ.get("RATES_STALE_TTL", 600))
+# Из upstream загружаются курсы только к этой валюте, курсы к остальным считаются локально,
+# поэтому при старте кэш прогревается только ею
+BASE_CURRENCY = os.environ.get("RATES_BASE_CURRENCY", "USD")
+MAX_BATCH_BODY = 16 * 1024 * 1024
+# Без кэша: тело upstream передаётся клиенту кусками по мере получения, вместе с его
+# Content-Length и Content-Encoding
+PASSTHROUGH = os.environ.get("RATES_PASSTHROUGH", "") == "1"
+
+
+class AppMetrics:
+    """Метрики приложения для /metrics: задержка ответов по маршруту и статусу, задержка
+    upstream по статусу (или типу исключения), запросы в работе и пул соединений сессии.
+    Обновляются в event loop без блокировок, запись - bisect и пара операций со словарём."""
+    def __init__(self):
+        self.requests = {}
+        self.upstream = {}
+        self.in_flight = 0
+
+    def observe_request(self, route: str, status: int, seconds: float) -> None:
+        histogram = self.requests.get((route, status))
+        if histogram is None:
+            histogram = self.requests[(route, status)] = Histogram()
+        histogram.observe(seconds)
+
+    def observe_upstream(self, status: int | str, seconds: float) -> None:
+        histogram = self.upstream.get(status)
+        if histogram is None:
+            histogram = self.upstream[status] = Histogram()
+        histogram.observe(seconds)
+
+    def pool_stats(self) -> dict:
+        if session is None or session.closed:
+            return {}
+        connector = session.connector
+        # У TCPConnector нет публичного API для занятых и свободных соединений
+        return {"limit": connector.limit,
+                "acquired": len(getattr(connector, "_acquired", ())),
+                "idle": sum(len(conns) for conns in getattr(connector, "_conns", {}).values())}
+
+    def prometheus(self) -> str:
+        lines = ["# TYPE asgi_request_seconds histogram"]
+        for (route, status), histogram in self.requests.items():
+            lines += histogram.prometheus("asgi_request_seconds", f'route="{route}",status="{status}"')
+        lines.append("# TYPE asgi_upstream_seconds histogram")
+        for status, histogram in self.upstream.items():
+            lines += histogram.prometheus("asgi_upstream_seconds", f'status="{status}"')
+        lines.append("# TYPE asgi_in_flight gauge")
+        lines.append(f"asgi_in_flight {self.in_flight}")
+        lines.append("# TYPE asgi_upstream_pool gauge")
+        lines += [f'asgi_upstream_pool{{state="{name}"}} {value}' for name, value in self.pool_stats().items()]
+        return "\n".join(lines) + "\n"
+
+
+app_metrics = AppMetrics()
+
+
+class UpstreamError(Exception):
+    """Ответ, который нужно отдать клиенту вместо курсов"""
+    def __init__(self, status: int, message: str):
+        super().__init__(message)
+        self.status = status
+        self.message = message
+
+
+def check_upstream_response(currency: str, response: aiohttp.ClientResponse) -> bytes | None:
+    """Тело ошибки 404 или None для ответа с курсами; остальные ответы - UpstreamError"""
+    if response.status == HTTPStatus.NOT_FOUND_404:
+        return json.dumps({"error": f"Unknown currency '{currency}'"}).encode()
+    if response.status != HTTPStatus.OK_200:
+        raise UpstreamError(HTTPStatus.SERVER_ERROR_520, "Server error")
+    if "application/json" not in response.headers.get("Content-Type", ""):
+        logger.error(f"Upstream вернул {response.headers.get('Content-Type')} вместо JSON для {currency}")
+        raise UpstreamError(HTTPStatus.BAD_REQUEST_400, "Invalid JSON response")
+    return None
+
+
+async def fetch_rates(currency: str) -> tuple[int, bytes]:
+    # Тело не разбирается и не собирается заново: upstream уже прислал JSON, он кэшируется как есть.
+    # Сжатие для кэша не запрашивается, а если upstream всё равно сжал ответ, сессия его распакует.
+    started = time.monotonic()
+    try:
+        async with session.get(UPSTREAM_URL.format(currency=currency),
+                               headers={"Accept-Encoding": "identity"}) as response:
+            app_metrics.observe_upstream(response.status, time.monotonic() - started)
+            error_body = check_upstream_response(currency, response)
+            if error_body is not None:
+                return HTTPStatus.NOT_FOUND_404, error_body
+            return HTTPStatus.OK_200, await response.read()
+    except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+        app_metrics.observe_upstream(type(e).__name__, time.monotonic() - started)
+        raise
+
+
+def get_header(scope, name: bytes) -> bytes | None:
+    for key, value in scope["headers"]:
+        if key.lower() == name:
+            return value
+    return None
+
+
+async def stream_rates(currency: str, scope, send) -> None:
+    """Передаёт тело upstream кусками по мере получения, без разбора и копирования в один буфер.
+    Клиентский Accept-Encoding уходит в upstream, а Content-Encoding и Content-Length
+    возвращаются клиенту, поэтому сжатое тело так и остаётся сжатым."""
+    accept_encoding = get_header(scope, b"accept-encoding") or b"identity"
+    response = None
+    started = time.monotonic()
+    try:
+        try:
+            response = await session.get(UPSTREAM_URL.format(currency=currency),
+                                         headers={"Accept-Encoding": accept_encoding.decode("latin-1")},
+                                         auto_decompress=False)
+            app_metrics.observe_upstream(response.status, time.monotonic() - started)
+            error_body = check_upstream_response(currency, response)
+        except UpstreamError as e:
+            return await send_complete_response(e.status, json.dumps({"error": e.message}), send)
+        except Exception as e:
+            if response is None:
+                app_metrics.observe_upstream(type(e).__name__, time.monotonic() - started)
+            logging.exception(e)
+            return await send_complete_response(HTTPStatus.SERVER_ERROR_520, json.dumps({"error": "Server error"}), send)
+        if error_body is not None:
+            return await send_complete_response(HTTPStatus.NOT_FOUND_404, error_body, send)
+
+        headers = [[b"content-type", response.headers["Content-Type"].encode("latin-1")]]
+        for name in ("Content-Length", "Content-Encoding"):
+            if name in response.headers:
+                headers.append([name.lower().encode(), response.headers[name].encode("latin-1")])
+        await send({"type": "http.response.start", "status": HTTPStatus.OK_200, "headers": headers})
+        # Ошибка после начала ответа пробрасывается: сервер оборвёт соединение,
+        # и клиент увидит неполное тело, а не обрезанный "успешный" ответ
+        async for chunk in response.content.iter_any():
+            await send({"type": "http.response.body", "body": chunk, "more_body": True})
+        await send({"type": "http.response.body", "body": b"", "more_body": False})
+    finally:
+        if response is not None:
+            response.release()
+
+
+class RatesCache:
+    """Кэш ответов upstream по валюте.
+
+    Одновременные промахи по одной валюте ждут одну общую загрузку (single-flight):
+    1000 запросов USD - один запрос к upstream. Загрузка защищена shield, поэтому
+    отключившийся клиент не отменяет её для остальных. Запись старше ttl, но моложе
+    ttl + stale_ttl отдаётся сразу, а обновляется в фоне. Ошибки не кэшируются.
+    """
+    def __init__(self, fetch, ttl: float = CACHE_TTL, stale_ttl: float = STALE_TTL):
+        self.fetch = fetch
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.entries = {}
+        self.in_flight = {}
+
+    async def get(self, currency: str) -> tuple[int, bytes]:
+        entry = self.entries.get(currency)
+        if entry is not None:
+            status, body, fetched_at = entry
+            age = time.monotonic() - fetched_at
+            if age < self.ttl:
+                return status, body
+            if age < self.ttl + self.stale_ttl:
+                self.refresh(currency)
+                return status, body
+        return await asyncio.shield(self.refresh(currency))
+
+    def refresh(self, currency: str) -> asyncio.Task:
+        task = self.in_flight.get(currency)
+        if task is None:
+            task = asyncio.create_task(self.load(currency))
+            self.in_flight[currency] = task
+            task.add_done_callback(lambda done: self.loaded(currency, done))
+        return task
+
+    async def load(self, currency: str) -> tuple[int, bytes]:
+        status, body = await self.fetch(currency)
+        self.entries[currency] = (status, body, time.monotonic())
+        return status, body
+
+    def loaded(self, currency: str, task: asyncio.Task) -> None:
+        self.in_flight.pop(currency, None)
+        # Ошибку фонового обновления никто не ждёт - забираем её здесь, чтобы она не потерялась
+        if not task.cancelled() and task.exception() is not None:
+            logger.warning(f"Не удалось обновить курсы {currency}: {type(task.exception()).__name__} - {task.exception()}")
+
+    async def warm(self, currencies: list) -> None:
+        results = await asyncio.gather(*(self.get(currency) for currency in currencies), return_exceptions=True)
+        loaded = sum(not isinstance(result, BaseException) for result in results)
+        logger.info(f"Кэш курсов прогрет: {loaded} из {len(currencies)}")
+
+
+rates_cache = RatesCache(fetch_rates)
+
+
+class RateTable:
+    """Курсы одного снимка upstream в массиве numpy: rates[i] - цена базовой валюты снимка в валюте i.
+
+    Курс from -> to равен rates[to] / rates[from], поэтому один снимок даёт курсы
+    к любой базе и любую пару без обращений к upstream. Ответ для каждой базы
+    сериализуется один раз на снимок.
+    """
+    def __init__(self, snapshot: dict):
+        self.meta = {key: value for key, value in snapshot.items() if key not in ("base", "rates")}
+        self.currencies = list(snapshot["rates"])
+        self.index = {currency: i for i, currency in enumerate(self.currencies)}
+        self.rates = np.fromiter(snapshot["rates"].values(), dtype=np.float64, count=len(self.currencies))
+        self.encoded = {}
+
+    def for_base(self, base: str) -> bytes | None:
+        body = self.encoded.get(base)
+        if body is None:
+            i = self.index.get(base)
+            if i is None:
+                return None
+            cross = self.rates / self.rates[i]
+            body = json.dumps({"base": base, **self.meta,
+                               "rates": dict(zip(self.currencies, cross.tolist()))}).encode()
+            self.encoded[base] = body
+        return body
+
+    def indices(self, currencies: list) -> np.ndarray:
+        try:
+            return np.fromiter((self.index[currency] for currency in currencies), dtype=np.intp, count=len(currencies))
+        except KeyError as e:
+            raise UpstreamError(HTTPStatus.UNPROCESSABLE_ENTITY_422, f"Unknown currency '{e.args[0]}'")
+
+    def convert(self, amounts: list, sources: list, targets: list) -> np.ndarray:
+        """Все конвертации одним векторным проходом"""
+        amounts = np.asarray(amounts, dtype=np.float64)
+        return amounts * self.rates[self.indices(targets)] / self.rates[self.indices(sources)]
+
+
+rate_table = None
+rate_table_source = None
+
+
+async def get_rate_table() -> RateTable:
+    """Таблица строится заново, только когда кэш получил новый снимок базовой валюты"""
+    global rate_table, rate_table_source
+    status, body = await rates_cache.get(BASE_CURRENCY)
+    if status != HTTPStatus.OK_200:
+        raise UpstreamError(HTTPStatus.SERVER_ERROR_520, "Server error")
+    if body is not rate_table_source:
+        rate_table = RateTable(json.loads(body))
+        rate_table_source = body
+    return rate_table
+
+
+async def read_body(receive) -> bytes:
+    body = bytearray()
+    while True:
+        message = await receive()
+        body += message.get("body", b"")
+        if len(body) > MAX_BATCH_BODY:
+            raise UpstreamError(HTTPStatus.PAYLOAD_TOO_LARGE_413, "Request body too large")
+        if not message.get("more_body", False):
+            return bytes(body)
+
+
+async def convert_batch(receive) -> bytes:
+    """POST /convert с телом [[amount, from, to], ...] - ответ {"date": ..., "results": [...]}"""
+    try:
+        conversions = json.loads(await read_body(receive))
+        # zip молча обрезал бы длинные строки, а null и true numpy превратил бы в NaN и 1
+        if not isinstance(conversions, list) or not all(
+                isinstance(row, list) and len(row) == 3 and type(row[0]) in (int, float) for row in conversions):
+            raise ValueError("Malformed conversion")
+        amounts, sources, targets = zip(*conversions) if conversions else ((), (), ())
+        sources = [currency.upper() for currency in sources]
+        targets = [currency.upper() for currency in targets]
+        amounts = np.asarray(amounts, dtype=np.float64)
+        # json.loads принимает NaN и Infinity, которые нельзя вернуть в ответе
+        if not np.isfinite(amounts).all():
+            raise ValueError("Non-finite amount")
+    except (ValueError, TypeError, AttributeError):
+        raise UpstreamError(HTTPStatus.BAD_REQUEST_400, "Expected a list of [amount, from, to]")
+    table = await get_rate_table()
+    results = table.convert(amounts, sources, targets)
+    if not np.isfinite(results).all():
+        raise UpstreamError(HTTPStatus.BAD_REQUEST_400, "Amount out of range")
+    return json.dumps({"date": table.meta.get("date"), "results": results.tolist()}).encode()
+
+async def send_complete_response(status:int, body:str | bytes, send):
     await send({'type': 'http.response.start',
                'status': status,
                'headers': [[b'content-type', b'application/json']]
                })
     await send({
             'type': 'http.response.body',
-            "body": body.encode()})
+            "body": body.encode() if isinstance(body, str) else body})
 
 async def lifespan(receive, send):
     global session
@@ -52,6 +346,8 @@ async def lifespan(receive, send):
 
     if event["type"] == "lifespan.startup":
         session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=5))
+        if not PASSTHROUGH:
+            await rates_cache.warm([BASE_CURRENCY])
         await send({"type": "lifespan.startup.complete"})
 
     event = await receive()
@@ -61,6 +357,38 @@ async def lifespan(receive, send):
         await send({"type": "lifespan.shutdown.complete"})
         return
 
+async def rates_app(scope, receive, send):
+    path = scope["path"].lstrip("/")
+
+    if path == "convert":
+        if scope["method"] != "POST":
+            return await send_complete_response(HTTPStatus.METHOD_NOT_ALLOWED_405, json.dumps({"error": "Use POST"}), send)
+        try:
+            return await send_complete_response(HTTPStatus.OK_200, await convert_batch(receive), send)
+        except UpstreamError as e:
+            return await send_complete_response(e.status, json.dumps({"error": e.message}), send)
+        except Exception as e:
+            logging.exception(e)
+            return await send_complete_response(HTTPStatus.SERVER_ERROR_520, json.dumps({"error": "Server error"}), send)
+
+    currency = path.upper()
+
+    if PASSTHROUGH:
+        return await stream_rates(currency, scope, send)
+
+    try:
+        body = (await get_rate_table()).for_base(currency)
+    except UpstreamError as e:
+        return await send_complete_response(e.status, json.dumps({"error": e.message}), send)
+    except Exception as e:
+        logging.exception(e)
+        return await send_complete_response(HTTPStatus.SERVER_ERROR_520, json.dumps({"error": "Server error"}), send)
+
+    if body is None:
+        return await send_complete_response(HTTPStatus.NOT_FOUND_404, json.dumps({"error": f"Unknown currency '{currency}'"}), send)
+    return await send_complete_response(HTTPStatus.OK_200, body, send)
+
+
 async def app(scope, receive, send):
     
     if scope["type"] == "lifespan":
@@ -68,28 +396,31 @@ async def app(scope, receive, send):
         return
     if scope['type'] != 'http':
         return
-    
+
+    # Метки маршрута фиксированы, чтобы число рядов в /metrics не зависело от запросов
     path = scope["path"].lstrip("/")
-    url = f"https://api.exchangerate-api.com/v4/latest/{path}"
+    if path == "metrics":
+        await send({"type": "http.response.start", "status": HTTPStatus.OK_200,
+                    "headers": [[b"content-type", b"text/plain; version=0.0.4"]]})
+        await send({"type": "http.response.body", "body": app_metrics.prometheus().encode()})
+        return
+    route = "convert" if path == "convert" else "rates"
 
-    try:
-        response = await session.get(url)
-        if response.status == HTTPStatus.NOT_FOUND_404:
-            return await send_complete_response(HTTPStatus.NOT_FOUND_404, json.dumps({"error": f"Unknown currency '{path}'"}), send)
-    except Exception as e:
-        logging.exception(e)
-        return await send_complete_response(HTTPStatus.SERVER_ERROR_520, json.dumps({"error": "Server error"}), send)
-    
-    try:
-        json_data = await response.json()
-    except aiohttp.ContentTypeError as e:
-        logging.exception(e)
-        return await send_complete_response(HTTPStatus.BAD_REQUEST_400, json.dumps({"error": "Invalid JSON response"}), send)
-    except Exception as e:
-        logging.exception(e)
-        return await send_complete_response(HTTPStatus.SERVER_ERROR_520, json.dumps({"error": "Server error"}), send)
+    status = HTTPStatus.SERVER_ERROR_520
 
-    return await send_complete_response(HTTPStatus.OK_200, json.dumps(json_data), send)
+    async def send_with_status(message):
+        nonlocal status
+        if message["type"] == "http.response.start":
+            status = message["status"]
+        await send(message)
+
+    started = time.monotonic()
+    app_metrics.in_flight += 1
+    try:
+        await rates_app(scope, receive, send_with_status)
+    finally:
+        app_metrics.in_flight -= 1
+        app_metrics.observe_request(route, status, time.monotonic() - started)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,138 @@
+import argparse
+import asyncio
+import json
+import multiprocessing
+import os
+import random
+import time
+import aiohttp
+from aiohttp import web
+import uvicorn
+
+HOST = "127.0.0.1"
+STUB_PORT = 8766
+APP_PORT = 8001
+CONCURRENCY_LEVELS = (1, 10, 50, 100)
+CURRENCIES = ("USD", "EUR", "RUB", "GBP", "JPY", "CNY", "CHF", "KZT")
+
+# fork из процесса с работающим event loop небезопасен
+mp_context = multiprocessing.get_context("spawn")
+
+
+def run_stub(latency: float) -> None:
+    """Заглушка api.exchangerate-api.com: /v4/latest/{currency} с задержкой latency секунд"""
+    rates = {currency: round(random.Random(currency).uniform(0.5, 150), 4) for currency in CURRENCIES}
+    rates["USD"] = 1.0
+
+    async def handle_latest(request: web.Request) -> web.Response:
+        currency = request.match_info["currency"].upper()
+        if latency:
+            await asyncio.sleep(latency)
+        if currency not in rates:
+            return web.Response(status=404)
+        return web.json_response({"base": currency, "date": "2026-01-01", "rates": rates})
+
+    app = web.Application()
+    app.router.add_get("/v4/latest/{currency}", handle_latest)
+    web.run_app(app, host=HOST, port=STUB_PORT, access_log=None, print=None)
+
+
+def run_app(passthrough: bool) -> None:
+    # asgi читает настройки из окружения при импорте
+    os.environ["RATES_UPSTREAM_URL"] = f"http://{HOST}:{STUB_PORT}/v4/latest/{{currency}}"
+    os.environ["RATES_PASSTHROUGH"] = "1" if passthrough else ""
+    uvicorn.run("asgi:app", host=HOST, port=APP_PORT, log_level="warning")
+
+
+async def wait_until_up(session: aiohttp.ClientSession, url: str, timeout: float = 10) -> None:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with session.get(url) as response:
+                await response.read()
+                return
+        except aiohttp.ClientError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.1)
+
+
+async def worker(session: aiohttp.ClientSession, deadline: float, latencies: list, errors: list,
+                 batch_share: float, rng: random.Random) -> None:
+    batch = json.dumps([[100, "USD", "EUR"], [5, "GBP", "JPY"]] * 50)
+    while time.monotonic() < deadline:
+        started = time.perf_counter()
+        try:
+            if rng.random() < batch_share:
+                request = session.post(f"http://{HOST}:{APP_PORT}/convert", data=batch)
+            else:
+                request = session.get(f"http://{HOST}:{APP_PORT}/{rng.choice(CURRENCIES)}")
+            async with request as response:
+                await response.read()
+                if response.status != 200:
+                    errors.append(response.status)
+        except aiohttp.ClientError as e:
+            errors.append(type(e).__name__)
+        latencies.append(time.perf_counter() - started)
+
+
+def percentile(values: list, q: float) -> float:
+    return values[min(len(values) - 1, int(q * len(values)))]
+
+
+async def run_level(session: aiohttp.ClientSession, concurrency: int, duration: float, batch_share: float) -> dict:
+    latencies, errors = [], []
+    deadline = time.monotonic() + duration
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(session, deadline, latencies, errors, batch_share, random.Random(i))
+                           for i in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {"concurrency": concurrency, "requests": len(latencies), "errors": len(errors),
+            "rps": len(latencies) / elapsed,
+            "p50_ms": percentile(latencies, 0.5) * 1000, "p99_ms": percentile(latencies, 0.99) * 1000}
+
+
+async def load_test(levels: list, duration: float, batch_share: float) -> list:
+    connector = aiohttp.TCPConnector(limit=0)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await wait_until_up(session, f"http://{HOST}:{APP_PORT}/metrics")
+        results = []
+        print(f"{'concurrency':>12}{'req/s':>10}{'p50 ms':>10}{'p99 ms':>10}{'errors':>8}")
+        for concurrency in levels:
+            result = await run_level(session, concurrency, duration, batch_share)
+            results.append(result)
+            print(f"{result['concurrency']:>12}{result['rps']:>10.0f}{result['p50_ms']:>10.2f}"
+                  f"{result['p99_ms']:>10.2f}{result['errors']:>8}")
+        async with session.get(f"http://{HOST}:{APP_PORT}/metrics") as response:
+            pool = [line for line in (await response.text()).splitlines() if line.startswith("asgi_upstream_pool")]
+        print("pool:", ", ".join(pool))
+        return results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Нагрузочный тест asgi.app против локальной заглушки upstream")
+    parser.add_argument("--levels", type=int, nargs="*", default=list(CONCURRENCY_LEVELS))
+    parser.add_argument("--duration", type=float, default=5, help="секунд на каждый уровень")
+    parser.add_argument("--upstream-latency", type=float, default=0.05)
+    parser.add_argument("--batch-share", type=float, default=0.1, help="доля запросов POST /convert")
+    parser.add_argument("--passthrough", action="store_true", help="без кэша, потоковая передача upstream")
+    parser.add_argument("--report", help="куда записать json с результатами")
+    args = parser.parse_args()
+
+    stub = mp_context.Process(target=run_stub, args=(args.upstream_latency,), daemon=True)
+    server = mp_context.Process(target=run_app, args=(args.passthrough,), daemon=True)
+    stub.start()
+    server.start()
+    try:
+        results = asyncio.run(load_test(args.levels, args.duration, args.batch_share))
+    finally:
+        server.terminate()
+        stub.terminate()
+    if args.report:
+        with open(args.report, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,131 @@
+import sqlite3
+import time
+
+# Сколько изменений держать в открытой транзакции. Отметки done коммитятся ещё и вызовом
+# commit() после каждой записанной пачки результатов, иначе после падения они повторятся
+COMMIT_EVERY = 1000
+
+
+class CrawlState:
+    """Состояние обхода в SQLite, ключ - url.
+
+    seen_run - в каком запуске url уже встречался во входном файле (дубликаты пропускаются),
+    done_run - в каком запуске он обработан и записан (при продолжении запуска пропускается),
+    etag / last_modified - валидаторы последнего ответа для условных запросов, record -
+    записанная по этому ответу строка: на 304 она повторяется в выводе нового обхода.
+    Запуск, который не дошёл до finish(), продолжается при следующем старте с resume=True.
+    """
+    def __init__(self, path: str, resume: bool = True):
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.executescript("""
+            CREATE TABLE IF NOT EXISTS runs (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                started_at REAL NOT NULL,
+                finished_at REAL,
+                output_offset INTEGER
+            );
+            CREATE TABLE IF NOT EXISTS urls (
+                url TEXT PRIMARY KEY,
+                seen_run INTEGER,
+                done_run INTEGER,
+                etag TEXT,
+                last_modified TEXT,
+                record BLOB
+            );
+        """)
+        if "output_offset" not in [row[1] for row in self.connection.execute("PRAGMA table_info(runs)")]:
+            self.connection.execute("ALTER TABLE runs ADD COLUMN output_offset INTEGER")
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(urls)")]
+        if "record" not in columns:
+            # База прежней версии: без записи условный запрос не шлётся, url обходится заново
+            self.connection.execute("ALTER TABLE urls ADD COLUMN record BLOB")
+        self.pending_writes = 0
+
+        last_run = self.connection.execute(
+            "SELECT id, finished_at, output_offset FROM runs ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+        self.resumed = bool(resume and last_run and last_run[1] is None)
+        # Размер вывода на момент последнего коммита: строки за ним не отмечены done и будут записаны снова
+        self.output_offset = None
+        if self.resumed:
+            self.run_id = last_run[0]
+            self.output_offset = last_run[2]
+            # Всё, что было взято в работу, но не записано до падения, нужно выдать снова
+            self.connection.execute(
+                "UPDATE urls SET seen_run = NULL WHERE seen_run = ? AND done_run IS NOT ?",
+                (self.run_id, self.run_id)
+            )
+        else:
+            self.run_id = self.connection.execute(
+                "INSERT INTO runs (started_at) VALUES (?)", (time.time(),)
+            ).lastrowid
+        self.connection.commit()
+
+    def write(self, sql: str, params: tuple) -> None:
+        self.connection.execute(sql, params)
+        self.pending_writes += 1
+        if self.pending_writes >= COMMIT_EVERY:
+            self.commit()
+
+    def commit(self, output_offset: int | None = None) -> None:
+        """output_offset - размер вывода, в который уже записаны все отмеченные done строки"""
+        if output_offset is not None:
+            self.connection.execute("UPDATE runs SET output_offset = ? WHERE id = ?", (output_offset, self.run_id))
+        self.connection.commit()
+        self.pending_writes = 0
+
+    def claim(self, url: str) -> bool:
+        """True, если url нужно обработать в этом запуске: он не дубликат и ещё не сделан"""
+        row = self.connection.execute("SELECT seen_run FROM urls WHERE url = ?", (url,)).fetchone()
+        if row is not None and row[0] == self.run_id:
+            return False
+        self.write(
+            "INSERT INTO urls (url, seen_run) VALUES (?, ?) "
+            "ON CONFLICT(url) DO UPDATE SET seen_run = excluded.seen_run",
+            (url, self.run_id)
+        )
+        return True
+
+    def conditional_headers(self, url: str) -> dict:
+        # Без сохранённой записи на 304 нечего было бы вывести, поэтому запрос полный
+        row = self.connection.execute(
+            "SELECT etag, last_modified FROM urls WHERE url = ? AND record IS NOT NULL", (url,)
+        ).fetchone()
+        headers = {}
+        if row is not None:
+            if row[0]:
+                headers["If-None-Match"] = row[0]
+            if row[1]:
+                headers["If-Modified-Since"] = row[1]
+        return headers
+
+    def record(self, url: str) -> bytes | None:
+        row = self.connection.execute("SELECT record FROM urls WHERE url = ?", (url,)).fetchone()
+        return row[0] if row is not None else None
+
+    def mark_done(self, url: str, etag: str | None, last_modified: str | None,
+                  record: bytes | None = None) -> None:
+        if record is not None:
+            # Новое содержимое: валидаторы заменяются вместе с записью, чтобы 304 на них
+            # всегда означал именно эту запись
+            self.write(
+                "UPDATE urls SET done_run = ?, etag = ?, last_modified = ?, record = ? WHERE url = ?",
+                (self.run_id, etag, last_modified, record, url)
+            )
+            return
+        # 304 может прийти без валидаторов - тогда сохраняются прежние
+        self.write(
+            "UPDATE urls SET done_run = ?, etag = COALESCE(?, etag), "
+            "last_modified = COALESCE(?, last_modified) WHERE url = ?",
+            (self.run_id, etag, last_modified, url)
+        )
+
+    def finish(self) -> None:
+        self.connection.execute("UPDATE runs SET finished_at = ? WHERE id = ?", (time.time(), self.run_id))
+        self.close()
+
+    def close(self) -> None:
+        self.connection.commit()
+        self.connection.close()
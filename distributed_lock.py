@@ -1,24 +1,134 @@
+import asyncio
 import datetime
+import logging
+import random
+import threading
 import time
 from functools import wraps
 import uuid
 import redis
+import redis.asyncio
+
+logging.basicConfig(
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S"
+)
+
+logger = logging.getLogger(__name__)
 
 redis_client = redis.Redis(host="localhost", port=6379, db=0)
+async_redis_client = redis.asyncio.Redis(host="localhost", port=6379, db=0)
+
+# Снять или продлить блокировку можно только своим токеном, проверка и действие атомарны
+RELEASE_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('DEL', KEYS[1])
+end
+return 0
+"""
+
+EXTEND_SCRIPT = """
+if redis.call('GET', KEYS[1]) == ARGV[1] then
+    return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+release_lock = redis_client.register_script(RELEASE_SCRIPT)
+extend_lock = redis_client.register_script(EXTEND_SCRIPT)
+async_release_lock = async_redis_client.register_script(RELEASE_SCRIPT)
+async_extend_lock = async_redis_client.register_script(EXTEND_SCRIPT)
+
+MIN_BACKOFF = 0.05
+MAX_BACKOFF = 1.0
+
+
+def acquire_lock(lock_key: str, token: str, ttl_ms: int, blocking_timeout: float | None) -> bool:
+    """Без blocking_timeout - одна попытка. Иначе повторяет попытки с экспоненциальной
+    задержкой и полным джиттером, пока не истечёт blocking_timeout."""
+    deadline = time.monotonic() + (blocking_timeout or 0)
+    backoff = MIN_BACKOFF
+    while True:
+        if redis_client.set(lock_key, token, nx=True, px=ttl_ms):
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        time.sleep(min(remaining, random.uniform(0, backoff)))
+        backoff = min(backoff * 2, MAX_BACKOFF)
+
+
+def watchdog(lock_key: str, token: str, lease_ms: int, renew_until: float, stopped: threading.Event) -> None:
+    """Продлевает аренду каждые lease/3, пока функция работает, но не дольше renew_until"""
+    while not stopped.wait(lease_ms / 3000):
+        if time.monotonic() >= renew_until:
+            logger.warning(f"Блокировка {lock_key} больше не продлевается: превышено max_processing_time")
+            return
+        try:
+            if not extend_lock(keys=[lock_key], args=[token, lease_ms]):
+                logger.error(f"Блокировка {lock_key} потеряна до завершения функции")
+                return
+        except redis.RedisError as e:
+            logger.warning(f"Не удалось продлить блокировку {lock_key}: {type(e).__name__} - {e}")
+
 
-def single(max_processing_time: datetime.timedelta):
+async def async_acquire_lock(lock_key: str, token: str, ttl_ms: int, blocking_timeout: float | None) -> bool:
+    deadline = time.monotonic() + (blocking_timeout or 0)
+    backoff = MIN_BACKOFF
+    while True:
+        if await async_redis_client.set(lock_key, token, nx=True, px=ttl_ms):
+            return True
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return False
+        await asyncio.sleep(min(remaining, random.uniform(0, backoff)))
+        backoff = min(backoff * 2, MAX_BACKOFF)
+
+
+async def async_watchdog(lock_key: str, token: str, lease_ms: int, renew_until: float) -> None:
+    while True:
+        await asyncio.sleep(lease_ms / 3000)
+        if time.monotonic() >= renew_until:
+            logger.warning(f"Блокировка {lock_key} больше не продлевается: превышено max_processing_time")
+            return
+        try:
+            if not await async_extend_lock(keys=[lock_key], args=[token, lease_ms]):
+                logger.error(f"Блокировка {lock_key} потеряна до завершения функции")
+                return
+        except redis.RedisError as e:
+            logger.warning(f"Не удалось продлить блокировку {lock_key}: {type(e).__name__} - {e}")
+
+
+def make_lock_key(func, key, args, kwargs) -> str:
+    lock_key = f"single:{func.__module__}.{func.__name__}"
+    if key is not None:
+        lock_key += f":{key(*args, **kwargs)}"
+    return lock_key
+
+
+def single(max_processing_time: datetime.timedelta,
+           lease_time: datetime.timedelta | None = None,
+           blocking_timeout: datetime.timedelta | None = None,
+           key=None):
+    """lease_time - короткий TTL, который продлевается фоновым потоком, пока функция
+    работает (но не дольше max_processing_time). Если процесс упадёт, блокировка
+    освободится через lease_time, а не через max_processing_time.
+    blocking_timeout - сколько ждать занятую блокировку вместо немедленной ошибки.
+    key - функция от тех же аргументов, что и декорируемая; вызовы с разными
+    значениями key (например, разные id транзакций) друг друга не блокируют."""
     def decorator(func):
-        lock_key = f"single:{func.__module__}.{func.__name__}"
 
         @wraps(func)
         def wrapper(*args, **kwargs):
+            lock_key = make_lock_key(func, key, args, kwargs)
             token = str(uuid.uuid4())
+            ttl = lease_time or max_processing_time
 
-            acquired = redis_client.set(
+            acquired = acquire_lock(
                 lock_key,
                 token,
-                nx=True,
-                ex=int(max_processing_time.total_seconds())  # TTL
+                int(ttl.total_seconds() * 1000),
+                blocking_timeout.total_seconds() if blocking_timeout else None
             )
 
             if not acquired:
@@ -26,22 +136,76 @@ def single(max_processing_time: datetime.timedelta):
                     f"Function {func.__name__} is already running somewhere else."
                 )
 
+            stopped = threading.Event()
+            if lease_time is not None:
+                renew_until = time.monotonic() + max_processing_time.total_seconds()
+                threading.Thread(
+                    target=watchdog,
+                    args=(lock_key, token, int(lease_time.total_seconds() * 1000), renew_until, stopped),
+                    daemon=True
+                ).start()
+
             try:
                 return func(*args, **kwargs)
 
             finally:
-                stored_token = redis_client.get(lock_key)
-                if stored_token and stored_token.decode() == token:
-                    redis_client.delete(lock_key) # 
+                stopped.set()
+                release_lock(keys=[lock_key], args=[token])
+
+        return wrapper
+
+    return decorator
+
+
+def async_single(max_processing_time: datetime.timedelta,
+                 lease_time: datetime.timedelta | None = None,
+                 blocking_timeout: datetime.timedelta | None = None,
+                 key=None):
+    """То же, что single, для корутин: redis.asyncio и продление аренды задачей в event loop"""
+    def decorator(func):
+
+        @wraps(func)
+        async def wrapper(*args, **kwargs):
+            lock_key = make_lock_key(func, key, args, kwargs)
+            token = str(uuid.uuid4())
+            ttl = lease_time or max_processing_time
+
+            acquired = await async_acquire_lock(
+                lock_key,
+                token,
+                int(ttl.total_seconds() * 1000),
+                blocking_timeout.total_seconds() if blocking_timeout else None
+            )
+
+            if not acquired:
+                raise RuntimeError(
+                    f"Function {func.__name__} is already running somewhere else."
+                )
+
+            watchdog_task = None
+            if lease_time is not None:
+                renew_until = time.monotonic() + max_processing_time.total_seconds()
+                watchdog_task = asyncio.create_task(
+                    async_watchdog(lock_key, token, int(lease_time.total_seconds() * 1000), renew_until)
+                )
+
+            try:
+                return await func(*args, **kwargs)
+
+            finally:
+                if watchdog_task is not None:
+                    watchdog_task.cancel()
+                await async_release_lock(keys=[lock_key], args=[token])
 
         return wrapper
 
     return decorator
-    
 
 
-@single(max_processing_time=datetime.timedelta(minutes=2))
-def process_transaction():
+
+@single(max_processing_time=datetime.timedelta(minutes=2), lease_time=datetime.timedelta(seconds=1),
+        key=lambda transaction_id: transaction_id)
+def process_transaction(transaction_id: str):
     time.sleep(2)
 
-process_transaction()
\ No newline at end of file
+process_transaction("tx-1")
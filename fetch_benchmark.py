@@ -0,0 +1,196 @@
+import argparse
+import asyncio
+import functools
+import json
+import os
+import random
+import tempfile
+import time
+import tracemalloc
+import aiohttp
+from aiohttp import web
+
+import fetch_pipeline
+import sharded_fetch
+from host_limiter import HostLimiters
+from retry_scheduler import RetryScheduler
+
+HOST = "127.0.0.1"
+PORT = 8765
+URLS_COUNT = 5_000
+CONSUMERS = 20
+SEED = 42
+
+# Сценарии набора: задержка ответа в секундах, доля ответов 503 и размер тела в байтах
+SCENARIOS = {
+    "baseline": {"latency": 0, "error_rate": 0, "payload_size": 64},
+    "latency_20ms": {"latency": 0.02, "error_rate": 0, "payload_size": 64},
+    "errors_5pct": {"latency": 0, "error_rate": 0.05, "payload_size": 64},
+    "payload_64k": {"latency": 0, "error_rate": 0, "payload_size": 64 * 1024},
+}
+
+
+async def handle_json(request: web.Request) -> web.Response:
+    """Ответ по текущему сценарию из request.app["scenario"]. Случайность с фиксированным
+    seed, поэтому при одинаковом порядке запросов ошибки приходятся на те же ответы."""
+    scenario = request.app["scenario"]
+    config = scenario["config"]
+    if config["latency"]:
+        await asyncio.sleep(config["latency"])
+    if config["error_rate"] and scenario["random"].random() < config["error_rate"]:
+        # Retry-After: 0 - повтор без случайной задержки, чтобы замеры были воспроизводимыми
+        return web.Response(status=503, headers={"Retry-After": "0"})
+    return web.json_response({"id": request.match_info["id"], "payload": "x" * config["payload_size"]})
+
+
+def configure_server(app: web.Application, config: dict) -> None:
+    app["scenario"].update(config=dict(config), random=random.Random(SEED))
+
+
+async def start_server(config: dict | None = None) -> web.AppRunner:
+    app = web.Application()
+    # Запущенное приложение менять нельзя, поэтому сценарий - изменяемый словарь внутри него
+    app["scenario"] = {}
+    configure_server(app, config or SCENARIOS["baseline"])
+    app.router.add_get("/json/{id}", handle_json)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, HOST, PORT).start()
+    return runner
+
+
+def write_urls(file_path: str, count: int) -> None:
+    with open(file_path, "w") as f:
+        for i in range(count):
+            f.write(f"http://{HOST}:{PORT}/json/{i}\n")
+
+
+async def session_per_consumer(urls_queue: asyncio.Queue, results_queue: asyncio.Queue,
+                               retry_scheduler: RetryScheduler, host_limiters: HostLimiters) -> None:
+    """Старое поведение: у каждого consumer-а своя сессия и свой пул соединений"""
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=2)) as session:
+        await fetch_pipeline.consumer(urls_queue, results_queue, session, fetch_pipeline.StatusHandler(),
+                                      retry_scheduler, host_limiters)
+
+
+async def fetch_urls_session_per_consumer(read_file_path: str, count_consumers: int, write_file_path: str):
+    results_queue = asyncio.Queue()
+    urls_queue = asyncio.Queue()
+
+    retry_scheduler = RetryScheduler(urls_queue)
+    retry_task = asyncio.create_task(retry_scheduler.run())
+    host_limiters = HostLimiters()
+
+    write_task = asyncio.create_task(fetch_pipeline.write_file(results_queue, write_file_path))
+    producer_task = asyncio.create_task(fetch_pipeline.producer(urls_queue, read_file_path))
+    consumers_tasks = [asyncio.create_task(session_per_consumer(urls_queue, results_queue, retry_scheduler, host_limiters))
+                       for _ in range(count_consumers)]
+
+    await producer_task
+    await urls_queue.join()
+    retry_task.cancel()
+    for _ in range(count_consumers):
+        await urls_queue.put(None)
+    await asyncio.gather(*consumers_tasks)
+    await results_queue.put(None)
+    await write_task
+
+
+async def fetch_urls_with_handler(handler: str, read_file_path: str, count_consumers: int, write_file_path: str):
+    await fetch_pipeline.fetch_urls(read_file_path, count_consumers, write_file_path,
+                                    handler=fetch_pipeline.HANDLERS[handler]())
+
+
+async def fetch_urls_sharded(count_processes: int, read_file_path: str, count_consumers: int, write_file_path: str):
+    await sharded_fetch.fetch_urls_sharded(read_file_path, count_processes, count_consumers, write_file_path,
+                                           handler="status", progress_interval=0.2)
+
+
+async def measure(name: str, fetch, urls_path: str, results_path: str, urls_count: int) -> float:
+    t = time.perf_counter()
+    await fetch(urls_path, CONSUMERS, results_path)
+    elapsed = time.perf_counter() - t
+    print(f"{name:<32}{urls_count / elapsed:>10.0f} req/s")
+    return urls_count / elapsed
+
+
+async def sample_memory(samples: list, interval: float) -> None:
+    start = time.perf_counter()
+    while True:
+        samples.append((time.perf_counter() - start, tracemalloc.get_traced_memory()[0]))
+        await asyncio.sleep(interval)
+
+
+async def measure_memory(name: str, fetch, urls_path: str, results_path: str, interval: float = 0.5) -> None:
+    """Печатает занятую python-объектами память во времени и её пик"""
+    samples = []
+    tracemalloc.start()
+    sampler = asyncio.create_task(sample_memory(samples, interval))
+    await fetch(urls_path, CONSUMERS, results_path)
+    sampler.cancel()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+
+    timeline = " ".join(f"{memory / 2**20:.1f}" for _, memory in samples[::max(1, len(samples) // 10)])
+    print(f"{name:<32}peak {peak / 2**20:>7.1f} MiB | MiB over time: {timeline}")
+
+
+async def run_suite(runner: web.AppRunner, urls_path: str, results_path: str, urls_count: int,
+                    scenarios: list, handlers: list, report_path: str | None) -> None:
+    """Каждый обработчик на каждом сценарии; report_path - json с req/s для сравнения между версиями"""
+    report = {}
+    for scenario in scenarios:
+        configure_server(runner.app, SCENARIOS[scenario])
+        print(f"{scenario}: {SCENARIOS[scenario]}")
+        for handler in handlers:
+            report[f"{scenario}/{handler}"] = round(await measure(
+                f"  {handler}", functools.partial(fetch_urls_with_handler, handler),
+                urls_path, results_path, urls_count), 1)
+    if report_path:
+        with open(report_path, "w") as f:
+            json.dump({"urls": urls_count, "consumers": CONSUMERS, "req_per_second": report}, f, indent=2)
+
+
+async def main(args: argparse.Namespace):
+    config = dict(SCENARIOS["baseline"])
+    for name in config:
+        if getattr(args, name) is not None:
+            config[name] = getattr(args, name)
+    runner = await start_server(config)
+    with tempfile.TemporaryDirectory() as tmp:
+        urls_path = os.path.join(tmp, "urls.txt")
+        results_path = os.path.join(tmp, "results.jsonl")
+        write_urls(urls_path, args.urls)
+
+        if args.mode == "suite":
+            await run_suite(runner, urls_path, results_path, args.urls, args.scenarios or list(SCENARIOS),
+                            args.handlers or list(fetch_pipeline.HANDLERS), args.report)
+        elif args.mode == "throughput":
+            await measure("session per consumer", fetch_urls_session_per_consumer, urls_path, results_path, args.urls)
+            await measure("shared session", functools.partial(fetch_urls_with_handler, "status"),
+                          urls_path, results_path, args.urls)
+            if args.processes > 1:
+                await measure(f"{args.processes} processes", functools.partial(fetch_urls_sharded, args.processes),
+                              urls_path, results_path, args.urls)
+        else:
+            unbounded = functools.partial(fetch_pipeline.fetch_urls, handler=fetch_pipeline.StatusHandler(),
+                                          urls_queue_size=0, results_queue_size=0)
+            bounded = functools.partial(fetch_pipeline.fetch_urls, handler=fetch_pipeline.StatusHandler())
+            await measure_memory("unbounded queues", unbounded, urls_path, results_path)
+            await measure_memory("bounded queues", bounded, urls_path, results_path)
+    await runner.cleanup()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description="Офлайн-замеры конвейера на локальном сервере")
+    parser.add_argument("mode", choices=["suite", "throughput", "memory"], nargs="?", default="suite")
+    parser.add_argument("--urls", type=int, default=URLS_COUNT)
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--scenarios", nargs="*", choices=sorted(SCENARIOS))
+    parser.add_argument("--handlers", nargs="*", choices=sorted(fetch_pipeline.HANDLERS))
+    parser.add_argument("--report", help="куда записать json с результатами набора")
+    # Параметры сервера для режимов throughput и memory
+    parser.add_argument("--latency", type=float)
+    parser.add_argument("--error-rate", dest="error_rate", type=float)
+    parser.add_argument("--payload-size", dest="payload_size", type=int)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,185 @@
+import asyncio
+import bisect
+from collections import defaultdict, deque
+import json
+import logging
+import time
+from urllib.parse import urlsplit
+
+from aiohttp import web
+
+logger = logging.getLogger(__name__)
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+TIMELINE_LENGTH = 600
+# Сколько хостов получают собственную гистограмму задержки, остальные считаются в "other"
+MAX_HOSTS = 50
+
+
+class Histogram:
+    """Гистограмма с фиксированными границами корзин, как в Prometheus: наблюдение - один bisect"""
+    def __init__(self, buckets: tuple = LATENCY_BUCKETS):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.count += 1
+        self.sum += value
+
+    def quantile(self, q: float) -> float | None:
+        """Оценка сверху: граница корзины, в которую попадает q-я доля наблюдений"""
+        if not self.count:
+            return None
+        rank = q * self.count
+        seen = 0
+        for i, count in enumerate(self.counts):
+            seen += count
+            if seen >= rank:
+                return self.buckets[i] if i < len(self.buckets) else float("inf")
+        return float("inf")
+
+    def summary(self) -> dict:
+        return {"count": self.count, "sum": round(self.sum, 6),
+                "p50": self.quantile(0.5), "p90": self.quantile(0.9), "p99": self.quantile(0.99)}
+
+    def prometheus(self, name: str, labels: str) -> list:
+        lines = []
+        cumulative = 0
+        for bound, count in zip(self.buckets + (float("inf"),), self.counts):
+            cumulative += count
+            le = "+Inf" if bound == float("inf") else repr(bound)
+            lines.append(f'{name}_bucket{{{labels}{"," if labels else ""}le="{le}"}} {cumulative}')
+        lines.append(f"{name}_sum{{{labels}}} {self.sum}")
+        lines.append(f"{name}_count{{{labels}}} {self.count}")
+        return lines
+
+
+class FetchMetrics:
+    """Метрики конвейера producer -> consumer -> writer.
+
+    Счётчики стадий (сколько url прочитано, запрошено, записано), глубины очередей во
+    времени, гистограммы задержки по хосту и статусу, повторы по причинам и объём байт.
+    Всё считается в event loop без блокировок, запись метрики - несколько операций со словарём.
+    Отдельные гистограммы получают только первые max_hosts хостов, остальные попадают в
+    host="other", чтобы память и число серий Prometheus не росли с числом хостов обхода
+    (max_hosts=0 - без разбивки по хостам). Выгружаются периодической строкой в лог, json-сводкой и в текстовом формате Prometheus.
+    """
+    def __init__(self, max_hosts: int = MAX_HOSTS):
+        self.started = time.monotonic()
+        self.max_hosts = max_hosts
+        self.hosts = set()
+        self.stages = defaultdict(int)
+        self.latency = defaultdict(Histogram)
+        self.retries = defaultdict(int)
+        self.bytes = defaultdict(int)
+        self.queues = {}
+        self.max_depth = defaultdict(int)
+        self.timeline = deque(maxlen=TIMELINE_LENGTH)
+
+    def stage(self, name: str, count: int = 1) -> None:
+        self.stages[name] += count
+
+    def host_label(self, url: str) -> str:
+        host = urlsplit(url).netloc
+        if host in self.hosts:
+            return host
+        if len(self.hosts) < self.max_hosts:
+            self.hosts.add(host)
+            return host
+        return "other"
+
+    def observe(self, url: str, status: int | str, seconds: float, received: int = 0) -> None:
+        self.latency[(self.host_label(url), str(status))].observe(seconds)
+        self.bytes["received"] += received
+
+    def retry(self, cause: str) -> None:
+        self.retries[cause] += 1
+
+    def written(self, size: int) -> None:
+        self.bytes["written"] += size
+
+    def watch(self, name: str, size) -> None:
+        """size - функция без аргументов, возвращающая текущую глубину очереди"""
+        self.queues[name] = size
+
+    def sample_queues(self) -> dict:
+        depths = {name: size() for name, size in self.queues.items()}
+        for name, depth in depths.items():
+            self.max_depth[name] = max(self.max_depth[name], depth)
+        self.timeline.append((round(time.monotonic() - self.started, 3), depths))
+        return depths
+
+    def log_line(self, depths: dict) -> str:
+        elapsed = time.monotonic() - self.started
+        rates = " ".join(f"{name}={count} ({count / elapsed:.0f}/с)" for name, count in self.stages.items())
+        queues = " ".join(f"{name}={depth}" for name, depth in depths.items())
+        retries = sum(self.retries.values())
+        return (f"Стадии: {rates} | очереди: {queues} | повторы: {retries} | "
+                f"получено {self.bytes['received'] / 2**20:.1f} MiB")
+
+    async def run(self, interval: float = 5, sample_interval: float = 0.5) -> None:
+        """Снимает глубины очередей каждые sample_interval и пишет строку в лог каждые interval"""
+        next_report = time.monotonic() + interval
+        while True:
+            await asyncio.sleep(sample_interval)
+            depths = self.sample_queues()
+            if time.monotonic() >= next_report:
+                logger.info(self.log_line(depths))
+                next_report += interval
+
+    def summary(self) -> dict:
+        elapsed = time.monotonic() - self.started
+        return {
+            "elapsed": round(elapsed, 3),
+            "stages": {name: {"count": count, "per_second": round(count / elapsed, 1)}
+                       for name, count in self.stages.items()},
+            "latency": {f"{host} {status}": histogram.summary()
+                        for (host, status), histogram in self.latency.items()},
+            "retries": dict(self.retries),
+            "bytes": dict(self.bytes),
+            "max_queue_depth": dict(self.max_depth),
+            "queue_depth_timeline": list(self.timeline),
+        }
+
+    def write_summary(self, path: str) -> None:
+        with open(path, "w") as f:
+            json.dump(self.summary(), f, ensure_ascii=False, indent=2)
+
+    def prometheus(self) -> str:
+        lines = ["# TYPE fetch_stage_total counter"]
+        lines += [f'fetch_stage_total{{stage="{name}"}} {count}' for name, count in self.stages.items()]
+        lines.append("# TYPE fetch_queue_depth gauge")
+        lines += [f'fetch_queue_depth{{queue="{name}"}} {size()}' for name, size in self.queues.items()]
+        lines.append("# TYPE fetch_retries_total counter")
+        lines += [f'fetch_retries_total{{cause="{cause}"}} {count}' for cause, count in self.retries.items()]
+        lines.append("# TYPE fetch_bytes_total counter")
+        lines += [f'fetch_bytes_total{{direction="{name}"}} {count}' for name, count in self.bytes.items()]
+        lines.append("# TYPE fetch_latency_seconds histogram")
+        for (host, status), histogram in self.latency.items():
+            lines += histogram.prometheus("fetch_latency_seconds", f'host="{host}",status="{status}"')
+        return "\n".join(lines) + "\n"
+
+    async def serve(self, host: str = "127.0.0.1", port: int = 9100) -> web.AppRunner:
+        """Отдаёт /metrics в формате Prometheus; остановить - await runner.cleanup()"""
+        async def handle_metrics(request: web.Request) -> web.Response:
+            return web.Response(text=self.prometheus(), content_type="text/plain")
+
+        app = web.Application()
+        app.router.add_get("/metrics", handle_metrics)
+        runner = web.AppRunner(app, access_log=None)
+        await runner.setup()
+        await web.TCPSite(runner, host, port).start()
+        return runner
+
+
+def retry_cause(status_code: int, exception: Exception) -> str:
+    if isinstance(exception, asyncio.TimeoutError):
+        return "timeout"
+    if status_code == 429:
+        return "429"
+    if status_code >= 500:
+        return "5xx"
+    return type(exception).__name__
@@ -0,0 +1,455 @@
+import argparse
+import asyncio
+import base64
+import json
+import logging
+import os
+import time
+import aiohttp
+import aiofiles
+
+from crawl_state import CrawlState
+from fetch_metrics import FetchMetrics, retry_cause
+from host_limiter import HostLimiters
+from retry_scheduler import RetryScheduler, backoff_delay, parse_retry_after
+
+logging.basicConfig(
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S"
+)
+
+logger = logging.getLogger(__name__)
+
+# Тела меньше этого размера разбираются в event loop, больше - в пуле потоков
+INLINE_PARSE_LIMIT = 64 * 1024
+FLUSH_BYTES = 1024 * 1024
+FLUSH_INTERVAL = 1.0
+
+
+class StatusHandler:
+    """Записывает только статус ответа, тело не читается. Неудачный запрос тоже
+    попадает в результат - со статусом ошибки или 0, если ответа не было."""
+    async def handle(self, url:str, response:aiohttp.ClientResponse) -> bytes | None:
+        return self.failed(url, response.status)
+
+    def failed(self, url:str, status_code:int) -> bytes | None:
+        return json.dumps({"url": url, "status_code": status_code}).encode("utf-8")
+
+
+def parse_json(body:bytes, charset:str | None):
+    return json.loads(body.decode(charset or "utf-8"))
+
+
+def dump_record(url:str, content) -> bytes:
+    return json.dumps({"url": url, "content": content}, ensure_ascii=False).encode("utf-8")
+
+
+class JsonHandler:
+    """Записывает {"url": ..., "content": ...} для ответов application/json.
+
+    Тело только проверяется на корректность JSON и вставляется в запись как есть, без
+    повторной сериализации. Заново сериализуется лишь тело в другой кодировке или с
+    переводами строк, которые сломали бы формат jsonl. Тела меньше INLINE_PARSE_LIMIT
+    разбираются прямо в event loop - переход в поток стоит дороже самого разбора.
+    """
+    async def handle(self, url:str, response:aiohttp.ClientResponse) -> bytes | None:
+        if "application/json" not in response.headers.get("Content-Type", ""):
+            return None
+        body = await response.read()
+        charset = response.charset
+        try:
+            return await self.make_record(url, body, charset)
+        except UnicodeDecodeError as e:
+            logger.exception(f"Неверная кодировка JSON: {type(e).__name__} - {e}")
+        except json.JSONDecodeError as e:
+            logger.exception(f"Ошибка парсинга JSON: {type(e).__name__} - {e}")
+        return None
+
+    async def make_record(self, url:str, body:bytes, charset:str | None) -> bytes:
+        loop = asyncio.get_running_loop()
+        inline = len(body) < INLINE_PARSE_LIMIT
+        if inline:
+            content = parse_json(body, charset)
+        else:
+            content = await loop.run_in_executor(None, parse_json, body, charset)
+
+        raw = body.strip()
+        if (charset or "utf-8").lower() in ("utf-8", "utf8") and b"\n" not in raw and b"\r" not in raw:
+            return b'{"url": ' + json.dumps(url, ensure_ascii=False).encode("utf-8") + b', "content": ' + raw + b"}"
+        if inline:
+            return dump_record(url, content)
+        return await loop.run_in_executor(None, dump_record, url, content)
+
+    def failed(self, url:str, status_code:int) -> bytes | None:
+        return None
+
+
+class BytesHandler:
+    """Записывает тело любого ответа без разбора: {"url", "status_code", "content_type", "body" в base64}"""
+    async def handle(self, url:str, response:aiohttp.ClientResponse) -> bytes | None:
+        body = await response.read()
+        return json.dumps({"url": url, "status_code": response.status,
+                           "content_type": response.headers.get("Content-Type"),
+                           "body": base64.b64encode(body).decode("ascii")}).encode("utf-8")
+
+    def failed(self, url:str, status_code:int) -> bytes | None:
+        return None
+
+
+HANDLERS = {
+    "status": StatusHandler,
+    "json": JsonHandler,
+    "bytes": BytesHandler,
+}
+
+
+async def producer(urls_queue:asyncio.Queue, file_path:str, chunk_size:int = 64 * 1024,
+                   state:CrawlState | None = None, metrics:FetchMetrics | None = None) -> None:
+    # Файл читается блоками по chunk_size: один переход в поток aiofiles на блок, а не на строку.
+    # Очередь ограничена, поэтому чтение останавливается, пока consumer-ы не разберут её.
+    # С state пропускаются дубликаты и url, уже обработанные в продолжаемом запуске.
+    async with aiofiles.open(file_path, mode="r") as f:
+        tail = ""
+        while True:
+            chunk = await f.read(chunk_size)
+            if not chunk:
+                break
+            lines = (tail + chunk).split("\n")
+            tail = lines.pop()
+            for url in lines:
+                url = url.strip()
+                if url and (state is None or state.claim(url)):
+                    await urls_queue.put((url, 1))
+                    if metrics is not None:
+                        metrics.stage("produced")
+        url = tail.strip()
+        if url and (state is None or state.claim(url)):
+            await urls_queue.put((url, 1))
+            if metrics is not None:
+                metrics.stage("produced")
+
+
+def make_session(limit:int = 100,
+                 limit_per_host:int = 0,
+                 ttl_dns_cache:int = 300,
+                 keepalive_timeout:float = 30,
+                 timeout:float = 2) -> aiohttp.ClientSession:
+    """Одна сессия на все consumer-ы: общий пул соединений с keep-alive и кэшем DNS.
+    limit - всего соединений, limit_per_host - к одному хосту (0 - без ограничения)."""
+    connector = aiohttp.TCPConnector(
+        limit=limit,
+        limit_per_host=limit_per_host,
+        ttl_dns_cache=ttl_dns_cache,
+        keepalive_timeout=keepalive_timeout,
+    )
+    return aiohttp.ClientSession(connector=connector, timeout=aiohttp.ClientTimeout(total=timeout))
+
+
+async def consumer(urls_queue:asyncio.Queue, results_queue:asyncio.Queue,
+                   session:aiohttp.ClientSession, handler,
+                   retry_scheduler:RetryScheduler, host_limiters:HostLimiters,
+                   state:CrawlState | None = None, metrics:FetchMetrics | None = None) -> None:
+    while True:
+        item = await urls_queue.get()
+        if item is None:
+            urls_queue.task_done()
+            break
+        url, attempt = item
+        host_limiter = host_limiters.get(url)
+        # Хост уже загружен до своего предела - откладываем url, не расходуя попытку.
+        # task_done для отложенных url вызывает планировщик, когда вернёт их в очередь.
+        if host_limiter.is_saturated():
+            if host_limiter.park(item):
+                continue
+            await host_limiter.wait_for_slot()
+        wait = host_limiter.try_acquire()
+        if wait is not None:
+            retry_scheduler.schedule(item, wait)
+            continue
+        started = time.monotonic()
+        congested = True
+        try:
+            headers = state.conditional_headers(url) if state is not None else None
+            line, retry_delay, validators, congested = await fetch(url, session, handler, attempt,
+                                                                   headers=headers, metrics=metrics)
+        finally:
+            for woken in host_limiter.release(time.monotonic() - started, congested):
+                retry_scheduler.schedule(woken, 0)
+        if retry_delay is not None:
+            retry_scheduler.schedule((url, attempt + 1), retry_delay)
+            continue
+        if validators.get("not_modified"):
+            # Содержимое не изменилось: в вывод снова идёт запись прошлого обхода
+            line = state.record(url) if state is not None else None
+        if metrics is not None:
+            metrics.stage("fetched")
+        await results_queue.put((url, line, validators))
+        urls_queue.task_done()
+
+
+def should_retry(status_code: int, exception: Exception) -> bool:
+    if exception:
+        if isinstance(exception, (aiohttp.ClientConnectorError, asyncio.TimeoutError)):
+            return True
+
+    if not status_code:
+        return False
+
+    if status_code == 429 or (500 <= status_code <= 599):
+        return True
+    if 400 <= status_code < 500:
+        return False
+    return False
+
+
+async def fetch(url:str,
+                session:aiohttp.ClientSession,
+                handler,
+                attempt:int = 1,
+                max_retries:int = 5,
+                headers:dict | None = None,
+                metrics:FetchMetrics | None = None) -> tuple[bytes | None, float | None, dict, bool]:
+    """Одна попытка запроса. Возвращает (строка jsonl в байтах или None, задержка перед повтором или None,
+    валидаторы ответа, перегружен ли хост). Хост считается перегруженным при 429, 5xx, таймауте
+    или отказе соединения - и на последней попытке, когда повтора уже не будет. Успешный ответ разбирает handler.handle, окончательно неудачный -
+    handler.failed. На 304 строки нет, а в валидаторах стоит "not_modified": True -
+    consumer берёт запись прошлого обхода из CrawlState."""
+    line = None
+    last_exception = None
+    status_code = 0
+    retry_after = None
+    validators = {}
+    received = 0
+    started = time.monotonic()
+    try:
+        async with session.get(url, headers=headers) as response:
+            status_code = response.status
+            retry_after = parse_retry_after(response.headers.get("Retry-After"))
+            try:
+                response.raise_for_status()
+                if status_code != 304:
+                    line = await handler.handle(url, response)
+                # Валидаторы сохраняются, только если по ответу есть запись: иначе следующий
+                # обход получил бы 304 для url, содержимое которого так и не было записано
+                if line is not None or status_code == 304:
+                    validators = {"etag": response.headers.get("ETag"),
+                                  "last_modified": response.headers.get("Last-Modified"),
+                                  "not_modified": status_code == 304}
+            finally:
+                received = response.content.total_bytes
+
+    except aiohttp.ClientResponseError as e:
+        last_exception = e
+        status_code = e.status
+        if not should_retry(status_code, e):
+            logger.exception(f"Ошибка HTTP: {type(e).__name__} - {e.status}", extra={"url": url, "attempt": attempt}, exc_info=True)
+
+    except (aiohttp.ClientConnectorError, asyncio.TimeoutError) as e:
+        last_exception = e
+
+    except aiohttp.InvalidURL as e:
+        logger.exception(f"Неправильный URL: {type(e).__name__} - {e}", extra={"url": url, "attempt": attempt}, exc_info=True)
+
+    except aiohttp.ClientError as e:
+        logger.exception(f"Общая ошибка клиента: {type(e).__name__} - {e}", extra={"url": url, "attempt": attempt}, exc_info=True)
+
+    except Exception as e:
+        logger.exception(f"Неожиданное исключение: {type(e).__name__} - {e}", extra={"url": url, "attempt": attempt}, exc_info=True)
+
+    if metrics is not None:
+        status = status_code or (type(last_exception).__name__ if last_exception is not None else "error")
+        metrics.observe(url, status, time.monotonic() - started, received)
+
+    congested = last_exception is not None and should_retry(status_code, last_exception)
+    if congested:
+        if attempt < max_retries:
+            if metrics is not None:
+                metrics.retry(retry_cause(status_code, last_exception))
+            return None, retry_after if retry_after is not None else backoff_delay(attempt), {}, True
+        if metrics is not None:
+            metrics.stage("exhausted")
+        logger.error(f"Попытки исчерпаны: {type(last_exception).__name__} - {last_exception}",
+                     extra={"url": url, "attempt": attempt}, exc_info=last_exception)
+
+    if line is None and (status_code == 0 or status_code >= 400):
+        line = handler.failed(url, status_code)
+    return line, None, validators, congested
+
+
+async def write_file(queue:asyncio.Queue, file_path:str, state:CrawlState | None = None, mode:str = "w",
+                     flush_bytes:int = FLUSH_BYTES, flush_interval:float = FLUSH_INTERVAL,
+                     metrics:FetchMetrics | None = None) -> None:
+    # Строки копятся в буфере и пишутся одним вызовом (один переход в поток aiofiles на пачку),
+    # когда буфер больше flush_bytes или с первой строки в нём прошло flush_interval секунд.
+    # url отмечаются обработанными только после записи пачки, чтобы при падении строки не потерялись.
+    loop = asyncio.get_running_loop()
+    buffer = bytearray()
+    done = []
+    deadline = None
+    async with aiofiles.open(file_path, mode=mode + "b") as f:
+
+        async def flush():
+            nonlocal deadline
+            if buffer:
+                await f.write(bytes(buffer))
+                await f.flush()
+                buffer.clear()
+            if state is not None and done:
+                for url, validators, line in done:
+                    # Запись сохраняется только вместе со своими валидаторами
+                    record = line if validators and not validators["not_modified"] else None
+                    state.mark_done(url, validators.get("etag"), validators.get("last_modified"), record)
+                # Отметки и размер вывода коммитятся вместе: при продолжении вывод обрезается до него
+                state.commit(await f.tell())
+            done.clear()
+            deadline = None
+
+        while True:
+            if deadline is None:
+                item = await queue.get()
+            else:
+                try:
+                    item = await asyncio.wait_for(queue.get(), max(0.0, deadline - loop.time()))
+                except asyncio.TimeoutError:
+                    await flush()
+                    continue
+            if item is None:
+                break
+            url, line, validators = item
+            if line is not None:
+                buffer += line
+                buffer += b"\n"
+                if metrics is not None:
+                    metrics.stage("written")
+                    metrics.written(len(line) + 1)
+            done.append((url, validators, line))
+            if deadline is None:
+                deadline = loop.time() + flush_interval
+            if len(buffer) >= flush_bytes:
+                await flush()
+            queue.task_done()
+        await flush()
+
+
+async def fetch_urls(read_file_path:str, count_consumers:int, write_file_path:str,
+                     handler=None,
+                     limit:int | None = None, limit_per_host:int = 0,
+                     ttl_dns_cache:int = 300, keepalive_timeout:float = 30,
+                     urls_queue_size:int = 1000, results_queue_size:int = 1000,
+                     max_rps_per_host:float | None = None,
+                     state_path:str | None = None, resume:bool = True,
+                     metrics_interval:float = 5, metrics_path:str | None = None,
+                     metrics_port:int | None = None):
+    # handler - что записать по ответу (StatusHandler, JsonHandler, BytesHandler), по умолчанию JsonHandler.
+    # Глубина очередей ограничена, чтобы память не зависела от размера входного файла (0 - без ограничения).
+    # count_consumers - общий предел параллельности, к каждому хосту он подбирается адаптивно (HostLimiter).
+    # state_path - файл SQLite с состоянием обхода: прерванный запуск продолжается (результаты
+    # дописываются в write_file_path), а повторный обход шлёт условные запросы по ETag/Last-Modified
+    # и перезаписывает write_file_path целиком: для неизменённых url (304) записи прошлого обхода
+    # берутся из state, поэтому их содержимое не теряется.
+    # Метрики стадий пишутся в лог (INFO) каждые metrics_interval секунд, json-сводка - в metrics_path
+    # по завершении, а при metrics_port они доступны в формате Prometheus на /metrics.
+    handler = handler or JsonHandler()
+    state = CrawlState(state_path, resume=resume) if state_path else None
+    metrics = FetchMetrics()
+    results_queue = asyncio.Queue(maxsize=results_queue_size)
+    urls_queue = asyncio.Queue(maxsize=urls_queue_size)
+
+    write_mode = "a" if state is not None and state.resumed else "w"
+    if write_mode == "a" and state.output_offset is not None and os.path.exists(write_file_path):
+        # Строки, записанные после последнего коммита, будут получены и записаны снова
+        os.truncate(write_file_path, min(state.output_offset, os.path.getsize(write_file_path)))
+    write_task = asyncio.create_task(write_file(results_queue, write_file_path, state=state, mode=write_mode,
+                                                metrics=metrics))
+
+    retry_scheduler = RetryScheduler(urls_queue)
+    retry_task = asyncio.create_task(retry_scheduler.run())
+    host_limiters = HostLimiters(max_rps=max_rps_per_host)
+
+    metrics.watch("urls", urls_queue.qsize)
+    metrics.watch("retries", retry_scheduler.__len__)
+    metrics.watch("results", results_queue.qsize)
+    metrics_task = asyncio.create_task(metrics.run(metrics_interval))
+    metrics_runner = await metrics.serve(port=metrics_port) if metrics_port else None
+
+    producer_task = asyncio.create_task(producer(urls_queue=urls_queue, file_path=read_file_path,
+                                                 state=state, metrics=metrics))
+    async with make_session(limit=limit or count_consumers, limit_per_host=limit_per_host,
+                            ttl_dns_cache=ttl_dns_cache, keepalive_timeout=keepalive_timeout) as session:
+        consumers_tasks = [asyncio.create_task(consumer(urls_queue=urls_queue,
+                                                        results_queue=results_queue,
+                                                        session=session, handler=handler,
+                                                        retry_scheduler=retry_scheduler,
+                                                        host_limiters=host_limiters,
+                                                        state=state,
+                                                        metrics=metrics)) for _ in range(count_consumers)]
+
+        await producer_task
+        # join() ждёт и отложенные повторы: их task_done() вызывается только после возврата в очередь.
+        # Упавший consumer task_done уже не вызовет, поэтому join ждём вместе с consumer-ами:
+        # до join consumer может завершиться только с исключением, и оно пробрасывается наверх.
+        join_task = asyncio.create_task(urls_queue.join())
+        await asyncio.wait([join_task, *consumers_tasks], return_when=asyncio.FIRST_COMPLETED)
+        if not join_task.done():
+            failed = next(task for task in consumers_tasks if task.done())
+            for task in (join_task, retry_task, metrics_task, write_task, producer_task, *consumers_tasks):
+                task.cancel()
+            if metrics_runner is not None:
+                await metrics_runner.cleanup()
+            if state is not None:
+                state.close()
+            raise failed.exception()
+        retry_task.cancel()
+        for _ in range(count_consumers):
+            await urls_queue.put(None)
+        await asyncio.gather(*consumers_tasks)
+    await results_queue.put(None)
+    await write_task
+    if state is not None:
+        state.finish()
+
+    metrics_task.cancel()
+    logger.info(metrics.log_line(metrics.sample_queues()))
+    if metrics_path:
+        metrics.write_summary(metrics_path)
+    if metrics_runner is not None:
+        await metrics_runner.cleanup()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Обход url из файла с записью результатов в jsonl")
+    parser.add_argument("urls", nargs="?", default="./urls.txt")
+    parser.add_argument("results", nargs="?", default="./results.jsonl")
+    parser.add_argument("--handler", choices=sorted(HANDLERS), default="json")
+    parser.add_argument("--consumers", type=int, default=10)
+    parser.add_argument("--processes", type=int, default=1,
+                        help="больше 1 - входной файл делится между процессами (sharded_fetch)")
+    parser.add_argument("--limit-per-host", type=int, default=0)
+    parser.add_argument("--max-rps-per-host", type=float)
+    parser.add_argument("--state", dest="state_path", help="файл SQLite для продолжения и условных запросов")
+    parser.add_argument("--no-resume", dest="resume", action="store_false")
+    parser.add_argument("--metrics-interval", type=float, default=5)
+    parser.add_argument("--metrics-path")
+    parser.add_argument("--metrics-port", type=int)
+    parser.add_argument("-v", "--verbose", action="store_true", help="писать метрики и прогресс в лог")
+    args = parser.parse_args()
+
+    if args.verbose:
+        logging.getLogger().setLevel(logging.INFO)
+    options = dict(limit_per_host=args.limit_per_host, max_rps_per_host=args.max_rps_per_host,
+                   state_path=args.state_path, resume=args.resume, metrics_interval=args.metrics_interval,
+                   metrics_path=args.metrics_path, metrics_port=args.metrics_port)
+    if args.processes > 1:
+        import sharded_fetch
+        # У каждого шарда свои метрики, общий прогресс пишет sharded_fetch
+        options.pop("metrics_path")
+        options.pop("metrics_port")
+        asyncio.run(sharded_fetch.fetch_urls_sharded(args.urls, args.processes, args.consumers, args.results,
+                                                     handler=args.handler, **options))
+    else:
+        asyncio.run(fetch_urls(args.urls, args.consumers, args.results, handler=HANDLERS[args.handler](),
+                               **options))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,113 @@
+import asyncio
+from collections import deque
+import time
+from urllib.parse import urlsplit
+
+
+class HostLimiter:
+    """Адаптивный предел одновременных запросов к одному хосту (AIMD).
+
+    Пока ответы быстрые (latency < latency_threshold), предел растёт примерно на
+    increase за каждые limit завершённых запросов. При 429, 5xx или таймауте предел
+    умножается на decrease, но не чаще раза в cooldown секунд, чтобы пачка
+    одновременных ошибок не обрушила его до минимума. max_rps дополнительно
+    ограничивает частоту запросов к хосту.
+
+    Элементы, пришедшие к хосту без свободных слотов, паркуются и возвращаются
+    из release(), когда слоты освобождаются, - без опроса по таймеру. Запаркованных
+    не больше max_parked, дальше consumer ждёт слот сам, чтобы память оставалась ограниченной.
+    """
+    def __init__(self, initial_limit: float = 4, min_limit: float = 1, max_limit: float = 64,
+                 increase: float = 1, decrease: float = 0.5, latency_threshold: float = 1.0,
+                 cooldown: float = 1.0, max_rps: float | None = None, max_parked: int = 1000):
+        self.limit = float(initial_limit)
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.increase = increase
+        self.decrease = decrease
+        self.latency_threshold = latency_threshold
+        self.cooldown = cooldown
+        self.interval = 1 / max_rps if max_rps else 0.0
+        self.in_flight = 0
+        self.next_allowed = 0.0
+        self.last_decrease = 0.0
+        self.parked = deque()
+        self.max_parked = max_parked
+        self.slot_freed = asyncio.Event()
+
+    def is_idle(self) -> bool:
+        """Нет запросов, запаркованных элементов и ожидания по max_rps - лимитер можно забыть"""
+        return self.in_flight == 0 and not self.parked and time.monotonic() >= self.next_allowed
+
+    def is_saturated(self) -> bool:
+        return self.in_flight >= int(self.limit)
+
+    def park(self, item) -> bool:
+        if len(self.parked) >= self.max_parked:
+            return False
+        self.parked.append(item)
+        return True
+
+    async def wait_for_slot(self) -> None:
+        while self.is_saturated():
+            self.slot_freed.clear()
+            await self.slot_freed.wait()
+
+    def try_acquire(self) -> float | None:
+        """Занимает слот и возвращает None, иначе - через сколько секунд позволит max_rps"""
+        now = time.monotonic()
+        if now < self.next_allowed:
+            return self.next_allowed - now
+        self.in_flight += 1
+        self.next_allowed = max(now, self.next_allowed) + self.interval
+        return None
+
+    def release(self, latency: float, congested: bool) -> list:
+        """Освобождает слот, обновляет предел и возвращает запаркованные элементы,
+        для которых теперь есть место"""
+        self.in_flight -= 1
+        self.slot_freed.set()
+        if congested:
+            now = time.monotonic()
+            if now - self.last_decrease >= self.cooldown:
+                self.limit = max(self.min_limit, self.limit * self.decrease)
+                self.last_decrease = now
+        elif latency < self.latency_threshold:
+            self.limit = min(self.max_limit, self.limit + self.increase / self.limit)
+
+        free = int(self.limit) - self.in_flight
+        woken = []
+        while free > 0 and self.parked:
+            woken.append(self.parked.popleft())
+            free -= 1
+        return woken
+
+
+# Меньше этого числа лимитеров простаивающие не удаляются
+SWEEP_MIN = 1024
+
+
+class HostLimiters:
+    """HostLimiter для каждого хоста, создаётся при первом обращении.
+
+    Когда лимитеров становится вдвое больше, чем после прошлой очистки, простаивающие
+    удаляются (их выученный предел забывается), поэтому память зависит от числа хостов,
+    к которым идут запросы сейчас, а не от числа всех хостов обхода.
+    """
+    def __init__(self, **options):
+        self.options = options
+        self.limiters = {}
+        self.sweep_at = SWEEP_MIN
+
+    def get(self, url: str) -> HostLimiter:
+        host = urlsplit(url).netloc
+        limiter = self.limiters.get(host)
+        if limiter is None:
+            if len(self.limiters) >= self.sweep_at:
+                self.sweep()
+            limiter = self.limiters[host] = HostLimiter(**self.options)
+        return limiter
+
+    def sweep(self) -> None:
+        self.limiters = {host: limiter for host, limiter in self.limiters.items() if not limiter.is_idle()}
+        self.sweep_at = max(SWEEP_MIN, 2 * len(self.limiters))
@@ -1,39 +1,436 @@
-from collections import OrderedDict
+import asyncio
+from collections import OrderedDict, namedtuple
+from concurrent.futures import Future, ThreadPoolExecutor
 import functools
+import inspect
+import sys
+import threading
+import time
 import unittest.mock
 
+CacheInfo = namedtuple("CacheInfo", ["hits", "misses", "evictions", "expirations",
+                                     "maxsize", "currsize", "bytes", "max_bytes"])
+
+
+def approx_sizeof(obj, seen=None) -> int:
+    """Приблизительный размер объекта в байтах вместе с вложенными контейнерами"""
+    if seen is None:
+        seen = set()
+    if id(obj) in seen:
+        return 0
+    seen.add(id(obj))
+
+    size = sys.getsizeof(obj)
+    if isinstance(obj, (str, bytes, bytearray, int, float, bool)) or obj is None:
+        return size
+    if isinstance(obj, dict):
+        for k, v in obj.items():
+            size += approx_sizeof(k, seen) + approx_sizeof(v, seen)
+    elif isinstance(obj, (list, tuple, set, frozenset)):
+        for item in obj:
+            size += approx_sizeof(item, seen)
+    elif hasattr(obj, "__dict__"):
+        size += approx_sizeof(vars(obj), seen)
+    return size
+
+
+class LRUPolicy:
+    """Классический LRU: вытесняется запись, к которой дольше всего не обращались"""
+    def __init__(self, maxsize: int | None):
+        self.maxsize = maxsize
+        self.data = OrderedDict()
+
+    def get(self, key):
+        entry = self.data.get(key)
+        if entry is not None:
+            self.data.move_to_end(key)
+        return entry
+
+    def put(self, key, entry) -> list:
+        """Добавляет новую запись и возвращает вытесненные пары (ключ, запись)"""
+        self.data[key] = entry
+        if self.maxsize is not None and len(self.data) > self.maxsize:
+            return [self.data.popitem(last=False)]
+        return []
+
+    def pop(self, key):
+        return self.data.pop(key, None)
+
+    def evict(self) -> tuple:
+        return self.data.popitem(last=False)
+
+    def clear(self) -> None:
+        self.data.clear()
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+
+class CountMinSketch:
+    """Приблизительные частоты обращений: 4 строки 4-битных счётчиков со старением"""
+    DEPTH = 4
+    SEEDS = (0x9E3779B97F4A7C15, 0xC2B2AE3D27D4EB4F, 0x165667B19E3779F9, 0xD6E8FEB86659FD93)
+    MAX_COUNT = 15
+
+    def __init__(self, capacity: int):
+        bits = max(4, (capacity - 1).bit_length() + 2)
+        self.shift = 64 - bits
+        self.rows = [bytearray(1 << bits) for _ in range(self.DEPTH)]
+        self.additions = 0
+        self.sample_size = 10 * capacity
+
+    def indexes(self, key):
+        h = hash(key)
+        shift = self.shift
+        return [((h * seed) & 0xFFFFFFFFFFFFFFFF) >> shift for seed in self.SEEDS]
+
+    def increment(self, key) -> None:
+        for row, i in zip(self.rows, self.indexes(key)):
+            if row[i] < self.MAX_COUNT:
+                row[i] += 1
+        self.additions += 1
+        if self.additions >= self.sample_size:
+            # Старение: старые популярные ключи не должны жить вечно
+            for row in self.rows:
+                row[:] = bytes(v >> 1 for v in row)
+            self.additions //= 2
+
+    def frequency(self, key) -> int:
+        return min(row[i] for row, i in zip(self.rows, self.indexes(key)))
+
+
+class TinyLFUPolicy:
+    """W-TinyLFU: маленькое LRU-окно (1%) перед сегментированным LRU (probation/protected).
+    Вытесненный из окна кандидат попадает в основную часть, только если по count-min sketch
+    он встречается чаще, чем жертва, поэтому разовые ключи сканирования не вытесняют горячие."""
+    def __init__(self, maxsize: int | None):
+        if maxsize is None:
+            raise ValueError("tinylfu policy requires maxsize")
+        self.window_size = max(1, maxsize // 100)
+        self.main_size = maxsize - self.window_size
+        self.protected_size = int(self.main_size * 0.8)
+        self.window = OrderedDict()
+        self.probation = OrderedDict()
+        self.protected = OrderedDict()
+        self.sketch = CountMinSketch(maxsize)
+
+    def get(self, key):
+        self.sketch.increment(key)
+        entry = self.window.get(key)
+        if entry is not None:
+            self.window.move_to_end(key)
+            return entry
+        entry = self.protected.get(key)
+        if entry is not None:
+            self.protected.move_to_end(key)
+            return entry
+        entry = self.probation.pop(key, None)
+        if entry is not None:
+            self.protected[key] = entry
+            if len(self.protected) > self.protected_size:
+                demoted_key, demoted_entry = self.protected.popitem(last=False)
+                self.probation[demoted_key] = demoted_entry
+        return entry
+
+    def put(self, key, entry) -> list:
+        self.window[key] = entry
+        if len(self.window) <= self.window_size:
+            return []
+
+        candidate = self.window.popitem(last=False)
+        if len(self.probation) + len(self.protected) < self.main_size:
+            self.probation[candidate[0]] = candidate[1]
+            return []
+        if not self.main_size:
+            return [candidate]
+
+        victims = self.probation if self.probation else self.protected
+        victim_key = next(iter(victims))
+        if self.sketch.frequency(candidate[0]) > self.sketch.frequency(victim_key):
+            victim_entry = victims.pop(victim_key)
+            self.probation[candidate[0]] = candidate[1]
+            return [(victim_key, victim_entry)]
+        return [candidate]
+
+    def pop(self, key):
+        for segment in (self.window, self.probation, self.protected):
+            if key in segment:
+                return segment.pop(key)
+        return None
+
+    def evict(self) -> tuple:
+        for segment in (self.probation, self.window, self.protected):
+            if segment:
+                return segment.popitem(last=False)
+        raise KeyError("evict from empty cache")
+
+    def clear(self) -> None:
+        self.window.clear()
+        self.probation.clear()
+        self.protected.clear()
+
+    def __len__(self) -> int:
+        return len(self.window) + len(self.probation) + len(self.protected)
+
+
+class ARCPolicy:
+    """Adaptive Replacement Cache: t1 - ключи, встреченные один раз, t2 - повторно.
+    Призрачные списки b1/b2 хранят только ключи вытесненных записей и сдвигают
+    целевой размер t1 (p) в сторону той части, которая чаще даёт повторные попадания."""
+    def __init__(self, maxsize: int | None):
+        if maxsize is None:
+            raise ValueError("arc policy requires maxsize")
+        self.maxsize = maxsize
+        self.p = 0
+        self.t1 = OrderedDict()
+        self.t2 = OrderedDict()
+        self.b1 = OrderedDict()
+        self.b2 = OrderedDict()
+
+    def get(self, key):
+        entry = self.t1.pop(key, None)
+        if entry is not None:
+            self.t2[key] = entry
+            return entry
+        entry = self.t2.get(key)
+        if entry is not None:
+            self.t2.move_to_end(key)
+        return entry
+
+    def replace(self, in_b2: bool) -> tuple:
+        if self.t1 and (not self.t2 or len(self.t1) > self.p or (in_b2 and len(self.t1) == self.p)):
+            key, entry = self.t1.popitem(last=False)
+            self.b1[key] = None
+        else:
+            key, entry = self.t2.popitem(last=False)
+            self.b2[key] = None
+        return key, entry
+
+    def put(self, key, entry) -> list:
+        c = self.maxsize
+        evicted = []
+        is_full = len(self.t1) + len(self.t2) >= c
+
+        if key in self.b1:
+            self.p = min(c, self.p + max(len(self.b2) // len(self.b1), 1))
+            del self.b1[key]
+            if is_full:
+                evicted.append(self.replace(False))
+            self.t2[key] = entry
+        elif key in self.b2:
+            self.p = max(0, self.p - max(len(self.b1) // len(self.b2), 1))
+            del self.b2[key]
+            if is_full:
+                evicted.append(self.replace(True))
+            self.t2[key] = entry
+        else:
+            if len(self.t1) + len(self.b1) >= c:
+                if len(self.t1) < c:
+                    self.b1.popitem(last=False)
+                    if is_full:
+                        evicted.append(self.replace(False))
+                else:
+                    evicted.append(self.t1.popitem(last=False))
+            else:
+                total = len(self.t1) + len(self.t2) + len(self.b1) + len(self.b2)
+                if total >= 2 * c and self.b2:
+                    self.b2.popitem(last=False)
+                if is_full:
+                    evicted.append(self.replace(False))
+            self.t1[key] = entry
+
+        while len(self.b1) + len(self.b2) > c:
+            (self.b1 if len(self.b1) > len(self.b2) else self.b2).popitem(last=False)
+        return evicted
+
+    def pop(self, key):
+        entry = self.t1.pop(key, None)
+        if entry is None:
+            entry = self.t2.pop(key, None)
+        return entry
+
+    def evict(self) -> tuple:
+        return self.replace(False)
+
+    def clear(self) -> None:
+        self.p = 0
+        for segment in (self.t1, self.t2, self.b1, self.b2):
+            segment.clear()
+
+    def __len__(self) -> int:
+        return len(self.t1) + len(self.t2)
+
+
+POLICIES = {"lru": LRUPolicy, "tinylfu": TinyLFUPolicy, "arc": ARCPolicy}
+
+# Разделитель позиционных и именованных аргументов в ключе, как в functools
+_KWARGS_MARK = (object(),)
+_FAST_TYPES = {int, str}
+
+
+def make_key(args: tuple, kwargs: dict):
+    """Плоский ключ без сортировки kwargs; один int/str аргумент используется как есть"""
+    key = args
+    if kwargs:
+        key += _KWARGS_MARK
+        for item in kwargs.items():
+            key += item
+    elif len(key) == 1 and type(key[0]) in _FAST_TYPES:
+        return key[0]
+    return key
+
+
 #redis для самых частоиспользуемых запросов
 #lru_cache для самых недавних запроосов
 #Сначала проверяется redis потом lru_cache, называется redis hit
-def lru_cache(maxsize:int = 128):
+def lru_cache(maxsize:int | None = 128, key=None, max_bytes:int | None = None, ttl:float | None = None,
+              policy="lru"):
+    """maxsize ограничивает число записей, max_bytes - их суммарный приблизительный размер
+    (размер считается только при заданном max_bytes, иначе cache_info().bytes - None).
+    ttl - время жизни записи в секундах, просроченные записи удаляются при обращении;
+    может быть функцией от результата, возвращающей время жизни этой записи или None;
+    результат, для которого она вернула 0 или меньше, не кэшируется.
+    policy - политика вытеснения: "lru", "tinylfu", "arc" или класс с тем же интерфейсом."""
 
-    if maxsize <= 0:
+    if maxsize is not None and maxsize <= 0:
         raise ValueError("maxsize must be positive or None")
+    if max_bytes is not None and max_bytes <= 0:
+        raise ValueError("max_bytes must be positive or None")
+    if ttl is not None and not callable(ttl) and ttl <= 0:
+        raise ValueError("ttl must be positive or None")
+    policy_class = POLICIES[policy] if isinstance(policy, str) else policy
 
     def cached(func):
-        cache = OrderedDict()
+        # ключ -> (результат, размер в байтах, момент истечения или None)
+        cache = policy_class(maxsize)
+        # Вычисления, которые уже запущены: ключ -> Future (для потоков) или Task (для корутин).
+        # Все одновременные промахи по одному ключу ждут один и тот же результат.
+        in_flight = {}
+        lock = threading.Lock()
+        stats = {"hits": 0, "misses": 0, "evictions": 0, "expirations": 0, "bytes": 0}
+
+        build_key = make_key if key is None else key
+
+        def lookup(key):
+            """Возвращает (True, результат) при попадании, вызывать под lock"""
+            entry = cache.get(key)
+            if entry is not None:
+                result, size, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    stats["hits"] += 1
+                    return True, result
+                cache.pop(key)
+                stats["bytes"] -= size
+                stats["expirations"] += 1
+            stats["misses"] += 1
+            return False, None
+
+        def store(key, result):
+            # Обход результата стоит O(его размера), без бюджета по памяти он не нужен
+            size = approx_sizeof(result) if max_bytes is not None else 0
+            if max_bytes is not None and size > max_bytes:
+                # Одна запись больше всего бюджета - не кэшируем, иначе она вытеснит всё
+                return
+            entry_ttl = ttl(result) if callable(ttl) else ttl
+            if entry_ttl is not None and entry_ttl <= 0:
+                return
+            expires_at = time.monotonic() + entry_ttl if entry_ttl is not None else None
+            old = cache.pop(key)
+            if old is not None:
+                stats["bytes"] -= old[1]
+            stats["bytes"] += size
+            for _, (_, evicted_size, _) in cache.put(key, (result, size, expires_at)):
+                stats["bytes"] -= evicted_size
+                stats["evictions"] += 1
+            while max_bytes is not None and stats["bytes"] > max_bytes and len(cache):
+                _, (_, evicted_size, _) = cache.evict()
+                stats["bytes"] -= evicted_size
+                stats["evictions"] += 1
+
+        def discard(cache_key):
+            with lock:
+                entry = cache.pop(cache_key)
+                if entry is not None:
+                    stats["bytes"] -= entry[1]
+
+        def cache_info() -> CacheInfo:
+            with lock:
+                return CacheInfo(stats["hits"], stats["misses"], stats["evictions"],
+                                 stats["expirations"], maxsize, len(cache),
+                                 stats["bytes"] if max_bytes is not None else None, max_bytes)
+
+        def cache_clear() -> None:
+            with lock:
+                cache.clear()
+                for name in stats:
+                    stats[name] = 0
+
+        def attach_api(wrapper):
+            wrapper.cache_discard = discard
+            wrapper.cache_info = cache_info
+            wrapper.cache_clear = cache_clear
+            return wrapper
+
+        if inspect.iscoroutinefunction(func):
+
+            async def fill(key, args, kwargs):
+                try:
+                    result = await func(*args, **kwargs)
+                    with lock:
+                        store(key, result)
+                    return result
+                finally:
+                    with lock:
+                        in_flight.pop(key, None)
+
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                key = build_key(args, kwargs)
+
+                with lock:
+                    found, result = lookup(key)
+                    if found:
+                        return result
+                    task = in_flight.get(key)
+                    if task is None:
+                        task = asyncio.ensure_future(fill(key, args, kwargs))
+                        in_flight[key] = task
+
+                # shield: отмена одного ожидающего не отменяет вычисление для остальных
+                return await asyncio.shield(task)
+            return attach_api(async_wrapper)
 
         @functools.wraps(func)
         def wrapper(*args, **kwargs):
-            key = None
-            if args and kwargs:
-                key = (args, tuple(sorted(kwargs.items())))
-            elif kwargs:
-                key = tuple(sorted(kwargs.items))
-            elif args:
-                key = tuple(args)
-
-            if key in cache:
-                cache.move_to_end(key)
-                return cache[key]
-            
-            result = func(*args, **kwargs)
-            cache[key] = result
-            if maxsize is not None and len(cache) > maxsize:
-                cache.popitem(last=False)
-            
+            key = build_key(args, kwargs)
+
+            with lock:
+                found, result = lookup(key)
+                if found:
+                    return result
+                future = in_flight.get(key)
+                is_owner = future is None
+                if is_owner:
+                    future = Future()
+                    in_flight[key] = future
+
+            if not is_owner:
+                return future.result()
+
+            try:
+                result = func(*args, **kwargs)
+            except BaseException as e:
+                with lock:
+                    in_flight.pop(key, None)
+                future.set_exception(e)
+                raise
+
+            with lock:
+                store(key, result)
+                in_flight.pop(key, None)
+            future.set_result(result)
             return result
-        return wrapper
+        return attach_api(wrapper)
     return cached
 
 
@@ -53,7 +450,7 @@ def multiply(a: int, b: int) -> int:
 
 
 if __name__ == '__main__':
-    
+
     assert sum(1, 2) == 3
     assert sum(3, 4) == 7
 
@@ -74,3 +471,73 @@ if __name__ == '__main__':
     assert decorated(5, 6) == 3
     assert decorated(1, 2) == 4
     assert mocked_func.call_count == 4
+
+    # Одновременные промахи по одному ключу из потоков вызывают функцию один раз
+    slow_mock = unittest.mock.Mock(side_effect=lambda x: time.sleep(0.1) or x * 2)
+    slow_decorated = lru_cache()(slow_mock)
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        results = list(executor.map(slow_decorated, [21] * 16))
+    assert results == [42] * 16
+    assert slow_mock.call_count == 1
+
+    # Для корутин кэшируется результат, а не объект корутины
+    calls = 0
+
+    @lru_cache()
+    async def fetch(x: int) -> int:
+        global calls
+        calls += 1
+        await asyncio.sleep(0.1)
+        return x * 2
+
+    async def main():
+        return await asyncio.gather(*(fetch(21) for _ in range(16)))
+
+    assert asyncio.run(main()) == [42] * 16
+    assert asyncio.run(main()) == [42] * 16
+    assert calls == 1
+
+    # Статистика, ttl и бюджет по памяти
+    info_mock = unittest.mock.Mock(side_effect=lambda x: x)
+    info_decorated = lru_cache(maxsize=2)(info_mock)
+    info_decorated(1), info_decorated(1), info_decorated(2), info_decorated(3)
+    info = info_decorated.cache_info()
+    assert (info.hits, info.misses, info.evictions, info.currsize) == (1, 3, 1, 2)
+    info_decorated.cache_clear()
+    assert info_decorated.cache_info().currsize == 0
+
+    ttl_mock = unittest.mock.Mock(side_effect=lambda x: x)
+    ttl_decorated = lru_cache(ttl=0.05)(ttl_mock)
+    ttl_decorated(1)
+    ttl_decorated(1)
+    time.sleep(0.1)
+    ttl_decorated(1)
+    assert ttl_mock.call_count == 2
+    assert ttl_decorated.cache_info().expirations == 1
+
+    bytes_decorated = lru_cache(maxsize=None, max_bytes=100_000)(lambda n: b"x" * n)
+    for i in range(10):
+        bytes_decorated(30_000 + i)
+    info = bytes_decorated.cache_info()
+    assert info.bytes <= 100_000 and info.currsize == 3 and info.evictions == 7
+    bytes_decorated(200_000)
+    assert bytes_decorated.cache_info().currsize == 3
+
+    # Вызов только с именованными аргументами
+    kwargs_mock = unittest.mock.Mock(side_effect=lambda **kw: kw["x"])
+    kwargs_decorated = lru_cache()(kwargs_mock)
+    assert kwargs_decorated(x=1) == kwargs_decorated(x=1) == 1
+    assert kwargs_mock.call_count == 1
+
+    # Сканирование разовыми ключами не вытесняет горячие ключи из tinylfu и arc
+    for policy in ("tinylfu", "arc"):
+        scan_decorated = lru_cache(maxsize=100, policy=policy)(lambda x: x)
+        for _ in range(5):
+            for hot in range(50):
+                scan_decorated(hot)
+        for cold in range(1000, 2000):
+            scan_decorated(cold)
+        hits_before = scan_decorated.cache_info().hits
+        for hot in range(50):
+            scan_decorated(hot)
+        assert scan_decorated.cache_info().hits - hits_before >= 45, policy
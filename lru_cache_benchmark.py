@@ -0,0 +1,55 @@
+import itertools
+import random
+import time
+
+from lru_cache import lru_cache, POLICIES
+
+CACHE_SIZE = 1_000
+TRACE_LENGTH = 200_000
+KEY_SPACE = 50_000
+
+
+def zipf_trace(length: int, key_space: int, alpha: float = 1.0, seed: int = 42) -> list[int]:
+    rnd = random.Random(seed)
+    weights = [1 / (rank ** alpha) for rank in range(1, key_space + 1)]
+    cum_weights = list(itertools.accumulate(weights))
+    return rnd.choices(range(key_space), cum_weights=cum_weights, k=length)
+
+
+def scan_trace(length: int, key_space: int, scan_every: int = 20_000,
+               scan_length: int = 5_000, seed: int = 42) -> list[int]:
+    """Zipf-нагрузка, которую периодически перебивает проход по уникальным ключам"""
+    base = zipf_trace(length, key_space, seed=seed)
+    trace = []
+    next_scan_key = key_space
+    for i, key in enumerate(base):
+        if i and i % scan_every == 0:
+            trace.extend(range(next_scan_key, next_scan_key + scan_length))
+            next_scan_key += scan_length
+        trace.append(key)
+    return trace
+
+
+def replay(policy: str, trace: list[int]) -> dict:
+    cached = lru_cache(maxsize=CACHE_SIZE, policy=policy)(lambda key: key)
+
+    t = time.perf_counter_ns()
+    for key in trace:
+        cached(key)
+    elapsed = time.perf_counter_ns() - t
+
+    info = cached.cache_info()
+    return {"hit_ratio": info.hits / (info.hits + info.misses), "ns_per_op": elapsed / len(trace)}
+
+
+if __name__ == '__main__':
+    traces = {
+        "zipf": zipf_trace(TRACE_LENGTH, KEY_SPACE),
+        "scan": scan_trace(TRACE_LENGTH, KEY_SPACE),
+    }
+
+    print(f"{'trace':<8}{'policy':<10}{'hit ratio':>12}{'ns/op':>10}")
+    for trace_name, trace in traces.items():
+        for policy in POLICIES:
+            result = replay(policy, trace)
+            print(f"{trace_name:<8}{policy:<10}{result['hit_ratio']:>12.3f}{result['ns_per_op']:>10.0f}")
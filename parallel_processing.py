@@ -1,11 +1,23 @@
+import functools
 import logging
+import math
+import pickle
+import queue
 import random
 import time
-from concurrent.futures import ThreadPoolExecutor
+from array import array
+from collections.abc import Sequence
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
 import multiprocessing
+from multiprocessing import shared_memory
 import pandas as pd
 
 DEFAULT_DATA_SIZE = 1_000_000
+# Сколько времени должен занимать один чанк: меньше - накладные расходы на передачу
+# и планирование заметны на фоне работы, больше - хуже балансировка между воркерами
+TARGET_CHUNK_TIME = 0.05
+CALIBRATION_TIME = 0.01
+CHUNKS_PER_WORKER = 4
 
 logging.basicConfig(
     format="%(asctime)s [%(levelname)s] %(message)s",
@@ -26,55 +38,331 @@ def time_logger(func):
 def generate_data(size:int) -> int:
     return [random.randint(1, 1000) for i in range(size)]
 
+
+class SharedArray:
+    """Типизированный массив (коды типов модуля array) в multiprocessing.shared_memory.
+
+    В другой процесс передаётся только имя сегмента, длина и тип - при распаковке
+    массив подключается к той же памяти без копирования данных. Создатель массива
+    удаляет сегмент через unlink() (или выходом из with), остальные только close().
+    """
+    def __init__(self, length: int, typecode: str, name: str | None = None):
+        self.length = length
+        self.typecode = typecode
+        itemsize = array(typecode).itemsize
+        self.owner = name is None
+        self.shm = shared_memory.SharedMemory(name=name, create=self.owner, size=max(1, length * itemsize))
+        self.view = self.shm.buf[:length * itemsize].cast(typecode)
+
+    def __reduce__(self):
+        return SharedArray, (self.length, self.typecode, self.shm.name)
+
+    def __len__(self) -> int:
+        return self.length
+
+    def close(self) -> None:
+        self.view.release()
+        self.shm.close()
+
+    def __del__(self):
+        # Без этого SharedMemory не закроется при сборке мусора в процессе-воркере: view держит буфер
+        view = getattr(self, "view", None)
+        if view is not None:
+            view.release()
+
+    def unlink(self) -> None:
+        self.shm.unlink()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+        if self.owner:
+            self.unlink()
+
+
+def generate_shared_data(size:int, typecode:str = "H", block_size:int = 64 * 1024) -> SharedArray:
+    """То же, что generate_data, но сразу в разделяемой памяти: блоками, без списка на size элементов"""
+    data = SharedArray(size, typecode)
+    for start in range(0, size, block_size):
+        stop = min(size, start + block_size)
+        data.view[start:stop] = array(typecode, random.choices(range(1, 1001), k=stop - start))
+    return data
+
 def process_number(number:int) -> int | None:
     result = 1
     for i in range(1, number + 1):
         result *= i
     return result
 
+# Факториал до 1000 не помещается в ячейку типизированного массива, поэтому
+# в разделяемый буфер результатов пишется его остаток по модулю простого числа
+RESULT_MODULUS = 2**61 - 1
+
+def process_number_fixed(number:int) -> int:
+    return process_number(number) % RESULT_MODULUS
+
 @time_logger
 def sync_execution(numbers:list):
     for number in numbers:
         process_number(number)
 
-@time_logger
-def thread_pool_execution(numbers:list, optimal_count_workerks:int):
-    with ThreadPoolExecutor(max_workers=optimal_count_workerks) as executor:
-        for number in numbers:
-            executor.submit(process_number, number)
+def run_chunk(func, chunk: list) -> list:
+    return [func(item) for item in chunk]
 
-@time_logger
-def multiprocessing_execution(numbers:list, optimal_count_workerks:int):
-    with multiprocessing.Pool(processes=optimal_count_workerks) as pool:
-        pool.map(process_number, numbers)
 
-def worker_work_func(queue:multiprocessing.Queue, func):
+def calibrate(func, items: Sequence, max_time: float = CALIBRATION_TIME) -> tuple[list, float]:
+    """Обрабатывает начало items в текущем процессе, пока не пройдёт max_time.
+    Возвращает результаты и затраченное время - по ним оценивается стоимость элемента."""
+    results = []
+    started = time.perf_counter()
+    elapsed = 0.0
+    for item in items:
+        results.append(func(item))
+        elapsed = time.perf_counter() - started
+        if elapsed >= max_time:
+            break
+    return results, elapsed
+
+
+def tune_chunksize(per_item: float, remaining: int, workers: int,
+                   target_chunk_time: float = TARGET_CHUNK_TIME) -> int:
+    chunksize = int(target_chunk_time / per_item) if per_item > 0 else remaining
+    # Чанков должно хватить всем воркерам с запасом, иначе последние чанки считает один воркер
+    balanced = math.ceil(remaining / (workers * CHUNKS_PER_WORKER))
+    return max(1, min(chunksize, balanced))
+
+
+def iter_chunks(items: Sequence, start: int, chunksize: int):
+    for i in range(start, len(items), chunksize):
+        yield items[i:i + chunksize]
+
+
+BACKENDS = ("thread", "process", "queue")
+
+
+def parallel_map(func, items, backend: str = "process", workers: int | None = None,
+                 chunksize: int | None = None, ordered: bool = True):
+    """Применяет func к items и возвращает итератор, отдающий результаты по мере готовности.
+
+    backend - "thread" (ThreadPoolExecutor), "process" (multiprocessing.Pool) или
+    "queue" (свои процессы с multiprocessing.Queue). Элементы передаются чанками:
+    без chunksize его размер подбирается так, чтобы чанк считался около TARGET_CHUNK_TIME,
+    для чего начало items обрабатывается в текущем процессе и замеряется.
+    ordered=False - результаты в порядке готовности чанков, а не в порядке items.
+    Исключение в воркере пробрасывается из итерации по результатам.
+    """
+    # Проверяется при вызове: генератор map_chunks сделал бы это только после калибровки
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend {backend!r}")
+    if not isinstance(items, Sequence):
+        items = list(items)
+    return map_chunks(func, items, backend, workers or multiprocessing.cpu_count(), chunksize, ordered)
+
+
+def map_chunks(func, items: Sequence, backend: str, workers: int, chunksize: int | None, ordered: bool):
+    start = 0
+    if chunksize is None:
+        sample, elapsed = calibrate(func, items)
+        start = len(sample)
+        yield from sample
+        if start == len(items):
+            return
+        chunksize = tune_chunksize(elapsed / start, len(items) - start, workers)
+        logger.debug(f"Размер чанка {chunksize} по замеру {start} элементов")
+
+    chunks = iter_chunks(items, start, chunksize)
+    if backend == "thread":
+        yield from thread_map(func, chunks, workers, ordered)
+    elif backend == "process":
+        with multiprocessing.Pool(processes=workers) as pool:
+            run = functools.partial(run_chunk, func)
+            for results in (pool.imap if ordered else pool.imap_unordered)(run, chunks):
+                yield from results
+    else:
+        for results in queue_map(functools.partial(run_chunk, func), chunks, workers, ordered):
+            yield from results
+
+
+def thread_map(func, chunks, workers: int, ordered: bool):
+    # В работе не больше 2 чанков на поток: чанки не копятся в памяти раньше времени
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        pending = {}
+        next_index = 0
+        done_results = {}
+        chunks = enumerate(chunks)
+        for index, chunk in chunks:
+            pending[executor.submit(run_chunk, func, chunk)] = index
+            if len(pending) >= workers * 2:
+                break
+        while pending:
+            done, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in done:
+                index = pending.pop(future)
+                done_results[index] = future.result()
+                for index, chunk in chunks:
+                    pending[executor.submit(run_chunk, func, chunk)] = index
+                    break
+            if ordered:
+                while next_index in done_results:
+                    yield from done_results.pop(next_index)
+                    next_index += 1
+            else:
+                for index in list(done_results):
+                    yield from done_results.pop(index)
+
+
+def queue_worker(tasks: multiprocessing.Queue, results: multiprocessing.Queue, run):
     while True:
-        item = queue.get(timeout=1)
-        if item is None:
+        task = tasks.get()
+        if task is None:
             break
+        index, payload = task
         try:
-            func(item)
+            payload = pickle.loads(payload)
+            # Результат сериализуется здесь, а не в фоновом потоке очереди: иначе ошибка
+            # pickle только печатается, и родитель ждёт результат, который не придёт
+            results.put((index, pickle.dumps(run(payload)), None))
         except Exception as e:
-            logger.exception(f"Неожиданное исключение: {type(e).__name__} - {e}", exc_info=True)
+            # Исключение уходит в родителя; если оно не сериализуется, отправляется его описание
+            try:
+                pickle.dumps(e)
+            except Exception:
+                e = RuntimeError(f"{type(e).__name__}: {e}")
+            results.put((index, None, e))
+
+
+def queue_map(run, payloads, workers: int, ordered: bool, poll_interval: float = 1.0):
+    """run(payload) в процессах-воркерах; отдаёт результаты run по одному на payload"""
+    tasks = multiprocessing.Queue()
+    results = multiprocessing.Queue()
+    processes = [multiprocessing.Process(target=queue_worker, args=(tasks, results, run), daemon=True)
+                 for _ in range(workers)]
+    for p in processes:
+        p.start()
+    try:
+        # Задания тоже сериализуются здесь: ошибка pickle поднимается в родителе, а не теряется
+        payloads = ((index, pickle.dumps(payload)) for index, payload in enumerate(payloads))
+        in_flight = 0
+        # В очереди не больше 2 заданий на процесс, остальные ещё не сериализованы
+        for task in payloads:
+            tasks.put(task)
+            in_flight += 1
+            if in_flight >= workers * 2:
+                break
+        next_index = 0
+        done_results = {}
+        while in_flight:
+            try:
+                index, result, error = results.get(timeout=poll_interval)
+            except queue.Empty:
+                # Воркер, убитый извне, не пришлёт ни результата, ни исключения
+                if not all(p.is_alive() for p in processes):
+                    raise RuntimeError("Queue worker exited unexpectedly")
+                continue
+            if error is not None:
+                raise error
+            result = pickle.loads(result)
+            in_flight -= 1
+            for task in payloads:
+                tasks.put(task)
+                in_flight += 1
+                break
+            if ordered:
+                done_results[index] = result
+                while next_index in done_results:
+                    yield done_results.pop(next_index)
+                    next_index += 1
+            else:
+                yield result
+        for _ in processes:
+            tasks.put(None)
+        for p in processes:
+            p.join()
+    finally:
+        # При досрочном выходе в очереди могут остаться задания - не ждём их отправки
+        tasks.cancel_join_thread()
+        for p in processes:
+            if p.is_alive():
+                p.terminate()
+
+
+def run_range(func, data: SharedArray, out: SharedArray, bounds: tuple) -> None:
+    source, target = data.view, out.view
+    for i in range(*bounds):
+        target[i] = func(source[i])
+
+
+shared_arrays = {}
+
+
+def attach_shared(data: SharedArray, out: SharedArray) -> None:
+    """Инициализатор процесса пула: массивы подключаются один раз, а не на каждое задание"""
+    shared_arrays["data"], shared_arrays["out"] = data, out
+
+
+def run_attached_range(func, bounds: tuple) -> None:
+    run_range(func, shared_arrays["data"], shared_arrays["out"], bounds)
+
+
+def shared_map(func, data: SharedArray, out_typecode: str = "q", backend: str = "process",
+               workers: int | None = None, chunksize: int | None = None) -> SharedArray:
+    """Применяет func к data и пишет результаты в новый SharedArray того же размера.
+
+    Воркеры получают только границы диапазонов индексов: входные данные и результаты
+    лежат в разделяемой памяти и не сериализуются. Результат func должен помещаться
+    в out_typecode. backend - "process" или "queue"; закрыть и удалить результат - with или unlink().
+    """
+    workers = workers or multiprocessing.cpu_count()
+    out = SharedArray(len(data), out_typecode)
+    try:
+        start = 0
+        if chunksize is None:
+            sample, elapsed = calibrate(func, data.view)
+            start = len(sample)
+            out.view[:start] = array(out_typecode, sample)
+            if start == len(data):
+                return out
+            chunksize = tune_chunksize(elapsed / start, len(data) - start, workers)
+        ranges = [(i, min(len(data), i + chunksize)) for i in range(start, len(data), chunksize)]
+
+        if backend == "process":
+            with multiprocessing.Pool(processes=workers, initializer=attach_shared, initargs=(data, out)) as pool:
+                for _ in pool.imap_unordered(functools.partial(run_attached_range, func), ranges):
+                    pass
+        elif backend == "queue":
+            for _ in queue_map(functools.partial(run_range, func, data, out), ranges, workers, ordered=False):
+                pass
+        else:
+            raise ValueError(f"Unknown backend {backend!r}")
+    except BaseException:
+        with out:
+            raise
+    return out
+
+
+def count_results(results) -> int:
+    # Результаты забираются потоком и сразу отбрасываются, чтобы 1M больших чисел не держать в памяти
+    return sum(1 for _ in results)
+
 
 @time_logger
-def multiprocessing_with_queue_execution(numbers:list, optimal_count_workerks:int):
-    queue = multiprocessing.Queue()
-    processes = []
-    for number in numbers:
-        queue.put(number)
+def thread_pool_execution(numbers:list, optimal_count_workerks:int):
+    return count_results(parallel_map(process_number, numbers, backend="thread", workers=optimal_count_workerks))
 
-    for i in range(optimal_count_workerks):
-        queue.put(None)
+@time_logger
+def multiprocessing_execution(numbers:list, optimal_count_workerks:int):
+    return count_results(parallel_map(process_number, numbers, backend="process", workers=optimal_count_workerks))
 
-    for i in range(optimal_count_workerks):
-        p = multiprocessing.Process(target=worker_work_func, args=(queue, process_number))
-        processes.append(p)
-        p.start()
+@time_logger
+def multiprocessing_with_queue_execution(numbers:list, optimal_count_workerks:int):
+    return count_results(parallel_map(process_number, numbers, backend="queue", workers=optimal_count_workerks))
 
-    for p in processes:
-        p.join()
+@time_logger
+def multiprocessing_shared_memory_execution(data:SharedArray, optimal_count_workerks:int, backend:str = "process"):
+    with shared_map(process_number_fixed, data, backend=backend, workers=optimal_count_workerks) as out:
+        return len(out)
 
 def visualization_results(results):
     # Создаем DataFrame для анализа
@@ -97,5 +385,8 @@ if __name__ == '__main__':
     results.append({"method":"thread_pool_execution","time_execution":thread_pool_execution(numbers, optimal_count_workerks)[0]})
     results.append({"method":"multiprocessing_execution","time_execution":multiprocessing_execution(numbers, optimal_count_workerks)[0]})
     results.append({"method":"multiprocessing_with_queue_execution","time_execution":multiprocessing_with_queue_execution(numbers, optimal_count_workerks)[0]})
+    with generate_shared_data(DEFAULT_DATA_SIZE) as shared_numbers:
+        results.append({"method":"multiprocessing_shared_memory_execution","time_execution":multiprocessing_shared_memory_execution(shared_numbers, optimal_count_workerks)[0]})
+        results.append({"method":"queue_shared_memory_execution","time_execution":multiprocessing_shared_memory_execution(shared_numbers, optimal_count_workerks, "queue")[0]})
     visualization_results(results)
     
\ No newline at end of file
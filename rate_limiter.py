@@ -1,7 +1,18 @@
+from concurrent.futures import Future
+import logging
+import queue
 import random
+import threading
 import time
+import uuid
 import redis
-import json
+
+logging.basicConfig(
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S"
+)
+
+logger = logging.getLogger(__name__)
 
 r = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
 
@@ -9,37 +20,306 @@ class RateLimitExceed(Exception):
     pass
 
 
+class Algorithm:
+    """Алгоритмы ограничения, каждый выполняется на стороне redis одним lua-скриптом"""
+    SLIDING_WINDOW_LOG = "sliding_window_log"
+    SLIDING_WINDOW_COUNTER = "sliding_window_counter"
+    TOKEN_BUCKET = "token_bucket"
+
+
+# Время берётся из redis (TIME), чтобы у всех клиентов были одни и те же часы.
+# Все скрипты возвращают {разрешено (0/1), через сколько мс можно повторить}.
+
+# ZSET: member - уникальный id запроса, score - время запроса в мс
+SLIDING_WINDOW_LOG_SCRIPT = """
+local key = KEYS[1]
+local limit = tonumber(ARGV[1])
+local window_ms = tonumber(ARGV[2])
+local member = ARGV[3]
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window_ms)
+if redis.call('ZCARD', key) < limit then
+    redis.call('ZADD', key, now, member)
+    redis.call('PEXPIRE', key, window_ms)
+    return {1, 0}
+end
+local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+return {0, tonumber(oldest[2]) + window_ms - now}
+"""
+
+# HASH: поле - номер фиксированного окна, значение - число запросов в нём.
+# Счётчик прошлого окна учитывается с весом оставшейся доли скользящего окна.
+SLIDING_WINDOW_COUNTER_SCRIPT = """
+local key = KEYS[1]
+local limit = tonumber(ARGV[1])
+local window_ms = tonumber(ARGV[2])
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+
+local current = math.floor(now / window_ms)
+local elapsed = (now % window_ms) / window_ms
+local counts = redis.call('HMGET', key, current, current - 1)
+local current_count = tonumber(counts[1]) or 0
+local previous_count = tonumber(counts[2]) or 0
+local estimated = previous_count * (1 - elapsed) + current_count
+
+if estimated + 1 > limit then
+    return {0, math.ceil(window_ms * (1 - elapsed))}
+end
+redis.call('HINCRBY', key, current, 1)
+redis.call('HDEL', key, current - 2)
+redis.call('PEXPIRE', key, window_ms * 2)
+return {1, 0}
+"""
+
+# HASH: tokens - остаток токенов, ts - время последнего пополнения в мс.
+# Пополняется со скоростью capacity / window, запрос забирает cost токенов.
+TOKEN_BUCKET_SCRIPT = """
+local key = KEYS[1]
+local capacity = tonumber(ARGV[1])
+local window_ms = tonumber(ARGV[2])
+local cost = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+local rate = capacity / window_ms
+
+local state = redis.call('HMGET', key, 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate)
+
+local allowed = 0
+local retry_after = 0
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = math.ceil((cost - tokens) / rate)
+end
+redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', key, math.ceil(window_ms * 2))
+return {allowed, retry_after}
+"""
+
+# Аренда пачки токенов из того же ведра: забирает до requested целых токенов, возвращает сколько выдано
+LEASE_SCRIPT = """
+local key = KEYS[1]
+local capacity = tonumber(ARGV[1])
+local window_ms = tonumber(ARGV[2])
+local requested = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+local rate = capacity / window_ms
+
+local state = redis.call('HMGET', key, 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate)
+
+local granted = math.min(requested, math.floor(tokens))
+tokens = tokens - granted
+redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', key, math.ceil(window_ms * 2))
+return granted
+"""
+
+# Возврат неизрасходованных токенов в ведро (не больше его ёмкости)
+RETURN_SCRIPT = """
+local key = KEYS[1]
+local capacity = tonumber(ARGV[1])
+local window_ms = tonumber(ARGV[2])
+local returned = tonumber(ARGV[3])
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+local rate = capacity / window_ms
+
+local state = redis.call('HMGET', key, 'tokens', 'ts')
+local tokens = tonumber(state[1]) or capacity
+local ts = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + (now - ts) * rate + returned)
+redis.call('HSET', key, 'tokens', tostring(tokens), 'ts', now)
+redis.call('PEXPIRE', key, math.ceil(window_ms * 2))
+return 1
+"""
+
+
 class RateLimiter:
+    SCRIPTS = {
+        Algorithm.SLIDING_WINDOW_LOG: SLIDING_WINDOW_LOG_SCRIPT,
+        Algorithm.SLIDING_WINDOW_COUNTER: SLIDING_WINDOW_COUNTER_SCRIPT,
+        Algorithm.TOKEN_BUCKET: TOKEN_BUCKET_SCRIPT,
+    }
+
+    def __init__(self, limit: int = 5, window: float = 3, algorithm: str = Algorithm.SLIDING_WINDOW_LOG,
+                 client: redis.Redis = r):
+        if limit <= 0 or window <= 0:
+            raise ValueError("limit and window must be positive")
+        self.limit = limit
+        self.window_ms = int(window * 1000)
+        self.algorithm = algorithm
+        self.client = client
+        # register_script отправляет EVALSHA и сам загружает скрипт при NOSCRIPT
+        self.script = client.register_script(self.SCRIPTS[algorithm])
+
+    def key(self, service_name: str) -> str:
+        return f"limiter:{self.algorithm}:{service_name}"
+
+    def check(self, service_name = "test") -> tuple[bool, float]:
+        """Проверяет лимит и сразу занимает место в нём - одна атомарная операция в redis.
+        Возвращает (разрешено, через сколько секунд имеет смысл повторить)."""
+        args = [self.limit, self.window_ms]
+        if self.algorithm == Algorithm.SLIDING_WINDOW_LOG:
+            args.append(uuid.uuid4().hex)
+        elif self.algorithm == Algorithm.TOKEN_BUCKET:
+            args.append(1)
+
+        allowed, retry_after_ms = self.script(keys=[self.key(service_name)], args=args)
+        return bool(allowed), int(retry_after_ms) / 1000
+
+    def test(self, service_name = "test") -> bool:
+        return self.check(service_name)[0]
+
+
+class LeasedRateLimiter(RateLimiter):
+    """Токен-бакет в redis, из которого процесс арендует пачки по lease_size токенов
+    и тратит их локально без обращения к redis.
+
+    Когда локальный остаток падает до low_watermark, фоновый поток заранее арендует
+    следующую пачку; в redis идём синхронно только если токены кончились совсем.
+    Аренда по сервису в процессе идёт одна за раз: остальные потоки (и фоновый, и
+    синхронные) ждут её результата, а не арендуют каждый свою пачку.
+    Токены, не использованные дольше окна, и всё, что осталось при close(), возвращаются.
+
+    Погрешность: арендованные токены уже списаны из общего ведра, поэтому за длинный
+    период лимит не превышается. Но процесс может держать до lease_size + low_watermark
+    токенов, полученных раньше, поэтому в любом окне N процессов могут пропустить
+    не более чем на N * (lease_size + low_watermark) запросов больше, чем обычный
+    токен-бакет. Обратная сторона - пока токены лежат в простаивающем процессе,
+    другим может быть отказано (не дольше одного окна).
+    """
+    def __init__(self, limit: int = 5, window: float = 3, lease_size: int | None = None,
+                 low_watermark: int | None = None, client: redis.Redis = r):
+        super().__init__(limit=limit, window=window, algorithm=Algorithm.TOKEN_BUCKET, client=client)
+        self.lease_size = lease_size or max(1, limit // 10)
+        self.low_watermark = self.lease_size // 4 if low_watermark is None else low_watermark
+        self.lease_script = client.register_script(LEASE_SCRIPT)
+        self.return_script = client.register_script(RETURN_SCRIPT)
+
+        self.lock = threading.Lock()
+        self.tokens = {}
+        self.last_used = {}
+        self.refilling = set()
+        # Идущие аренды: сервис -> Future с числом выданных токенов
+        self.leasing = {}
+        self.refill_queue = queue.Queue()
+        self.closed = False
+        self.refill_thread = threading.Thread(target=self.refill_loop, daemon=True)
+        self.refill_thread.start()
+
+    def lease(self, service_name: str) -> int:
+        return int(self.lease_script(keys=[self.key(service_name)],
+                                     args=[self.limit, self.window_ms, self.lease_size]))
+
+    def give_back(self, service_name: str, count: int) -> None:
+        if count > 0:
+            self.return_script(keys=[self.key(service_name)], args=[self.limit, self.window_ms, count])
+
+    def shared_lease(self, service_name: str) -> int:
+        """Арендует пачку в локальный остаток; если аренда уже идёт, ждёт её и возвращает её результат"""
+        with self.lock:
+            future = self.leasing.get(service_name)
+            is_owner = future is None
+            if is_owner:
+                future = self.leasing[service_name] = Future()
+        if not is_owner:
+            return future.result()
+
+        try:
+            granted = self.lease(service_name)
+        except BaseException as e:
+            with self.lock:
+                self.leasing.pop(service_name, None)
+            future.set_exception(e)
+            raise
+        with self.lock:
+            self.tokens[service_name] = self.tokens.get(service_name, 0) + granted
+            self.last_used[service_name] = time.monotonic()
+            self.leasing.pop(service_name, None)
+        future.set_result(granted)
+        return granted
+
+    def take_local(self, service_name: str) -> bool:
+        with self.lock:
+            local = self.tokens.get(service_name, 0)
+            if local <= 0:
+                return False
+            self.tokens[service_name] = local - 1
+            self.last_used[service_name] = time.monotonic()
+            if local - 1 <= self.low_watermark and service_name not in self.refilling:
+                self.refilling.add(service_name)
+                self.refill_queue.put(service_name)
+            return True
+
     def test(self, service_name = "test") -> bool:
-        self.check_and_delete_expired_time(service_name)
-        if r.llen(f"limiter:{service_name}") == 5:
-            return False
+        # Токены общей аренды могут разобрать другие потоки - тогда арендуем снова,
+        # пока ведро в redis не опустеет
+        while not self.take_local(service_name):
+            if not self.shared_lease(service_name):
+                return False
         return True
-    
-    def check_and_delete_expired_time(self, service_name):
-        now = time.time()
-        while True:
-            expired_time_list = r.lrange(f"limiter:{service_name}", 0, 0)
-            if len(expired_time_list) == 0:
-                break
 
-            expired_time = json.loads(expired_time_list[0])["expired_at"]
-            if expired_time < now:
-                r.lpop(f"limiter:{service_name}")
-            else:
+    def refill_loop(self) -> None:
+        while not self.closed:
+            try:
+                service_name = self.refill_queue.get(timeout=self.window_ms / 1000)
+            except queue.Empty:
+                self.return_idle()
+                continue
+            if service_name is None:
                 break
-    
+            try:
+                self.shared_lease(service_name)
+            except redis.RedisError as e:
+                logger.warning(f"Не удалось арендовать токены: {type(e).__name__} - {e}")
+            with self.lock:
+                self.refilling.discard(service_name)
+
+    def take_all(self, service_name: str) -> int:
+        with self.lock:
+            count = self.tokens.pop(service_name, 0)
+            self.last_used.pop(service_name, None)
+        return count
+
+    def return_idle(self) -> None:
+        deadline = time.monotonic() - self.window_ms / 1000
+        with self.lock:
+            idle = [name for name, used_at in self.last_used.items() if used_at < deadline]
+        for service_name in idle:
+            self.give_back(service_name, self.take_all(service_name))
+
+    def close(self) -> None:
+        self.closed = True
+        self.refill_queue.put(None)
+        self.refill_thread.join()
+        for service_name in list(self.tokens):
+            self.give_back(service_name, self.take_all(service_name))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
 
 def make_api_request(rate_limiter: RateLimiter, service_name = "test"):
-    if not rate_limiter.test():
+    if not rate_limiter.test(service_name):
         raise RateLimitExceed
-    else:
-        expired_at = time.time() + 3
-        r.rpush(f"limiter:{service_name}", json.dumps({"expired_at":expired_at}))
 
 
 if __name__ == '__main__':
-    rate_limiter = RateLimiter()
+    rate_limiter = RateLimiter(limit=5, window=3)
 
     for _ in range(50):
         time.sleep(random.randint(1, 2))
@@ -49,4 +329,4 @@ if __name__ == '__main__':
         except RateLimitExceed:
             print("Rate limit exceed!")
         else:
-            print("All good")
\ No newline at end of file
+            print("All good")
@@ -1,15 +1,270 @@
+from concurrent.futures import ThreadPoolExecutor
+import logging
+import threading
+import time
+import uuid
 import redis
 import json
+
+logging.basicConfig(
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S"
+)
+
+logger = logging.getLogger(__name__)
+
 r = redis.Redis(host='localhost', port=6379, db=0, decode_responses=True)
 
+# Сколько сообщений отправлять одной командой RPUSH / забирать одним LPOP
+BATCH_SIZE = 1000
+
 class RedisQueue:
+    def __init__(self, name: str = "queue", client: redis.Redis = r):
+        self.name = name
+        self.client = client
+
     def publish(self, msg: dict):
-            r.rpush("queue", json.dumps(msg))
+            self.client.rpush(self.name, json.dumps(msg))
 
-    def consume(self) -> dict:
-        result = json.loads(r.lpop("queue"))
+    def publish_many(self, msgs) -> int:
+        """Отправляет сообщения пачками по BATCH_SIZE, все пачки - одним pipeline"""
+        pipe = self.client.pipeline(transaction=False)
+        batch = []
+        count = 0
+        for msg in msgs:
+            batch.append(json.dumps(msg))
+            if len(batch) == BATCH_SIZE:
+                pipe.rpush(self.name, *batch)
+                count += len(batch)
+                batch = []
+        if batch:
+            pipe.rpush(self.name, *batch)
+            count += len(batch)
+        pipe.execute()
+        return count
+
+    def consume(self, block: bool = False, timeout: float = 0) -> dict | None:
+        """Возвращает None, если очередь пуста. block=True ждёт сообщение через BLPOP,
+        timeout=0 - без ограничения по времени."""
+        if block:
+            item = self.client.blpop([self.name], timeout=timeout)
+            raw = item[1] if item else None
+        else:
+            raw = self.client.lpop(self.name)
+        if raw is None:
+            return None
+        result = json.loads(raw)
         return result
 
+    def consume_many(self, count: int = BATCH_SIZE, block: bool = False, timeout: float = 0) -> list[dict]:
+        """Забирает до count сообщений за одну команду (LPOP count / BLMPOP)"""
+        if block:
+            item = self.client.blmpop(timeout, 1, self.name, direction="LEFT", count=count)
+            raws = item[1] if item else []
+        else:
+            raws = self.client.lpop(self.name, count) or []
+        return [json.loads(raw) for raw in raws]
+
+
+# Атомарно переносит до count сообщений в processing, ставит им срок видимости и
+# выдаёт квитанцию - номер получения сообщения из {name}:receipts.
+# Возвращает плоский список: сообщение, квитанция, сообщение, квитанция...
+FETCH_SCRIPT = """
+local t = redis.call('TIME')
+local deadline = t[1] * 1000 + math.floor(t[2] / 1000) + tonumber(ARGV[1])
+local result = {}
+for i = 1, tonumber(ARGV[2]) do
+    local raw = redis.call('LMOVE', KEYS[1], KEYS[2], 'LEFT', 'RIGHT')
+    if not raw then
+        break
+    end
+    redis.call('ZADD', KEYS[3], deadline, raw)
+    result[2 * i - 1] = raw
+    result[2 * i] = redis.call('HINCRBY', KEYS[4], raw, 1)
+end
+return result
+"""
+
+# Квитанция и срок для сообщения, полученного через BLMOVE. Если reap уже вернул его
+# в очередь (сообщения нет в processing), квитанция не выдаётся.
+CLAIM_SCRIPT = """
+if not redis.call('LPOS', KEYS[2], ARGV[1]) then
+    return false
+end
+local t = redis.call('TIME')
+redis.call('ZADD', KEYS[3], t[1] * 1000 + math.floor(t[2] / 1000) + tonumber(ARGV[2]), ARGV[1])
+return redis.call('HINCRBY', KEYS[4], ARGV[1], 1)
+"""
+
+# ack и nack действуют, только если квитанция совпадает с последней выданной: поздний
+# ack потребителя, чьё сообщение reap уже отдал другому, не удаляет чужую доставку.
+# Счётчик квитанций при nack сохраняется, чтобы следующая доставка получила новый номер.
+ACK_SCRIPT = """
+if redis.call('HGET', KEYS[4], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+local removed = redis.call('LREM', KEYS[2], 1, ARGV[1])
+redis.call('ZREM', KEYS[3], ARGV[1])
+redis.call('HDEL', KEYS[4], ARGV[1])
+return removed
+"""
+
+NACK_SCRIPT = """
+if redis.call('HGET', KEYS[4], ARGV[1]) ~= ARGV[2] then
+    return 0
+end
+local removed = redis.call('LREM', KEYS[2], 1, ARGV[1])
+redis.call('ZREM', KEYS[3], ARGV[1])
+if removed > 0 then
+    redis.call('RPUSH', KEYS[1], ARGV[1])
+end
+return removed
+"""
+
+# Возвращает в очередь сообщения с истёкшим сроком видимости. Сообщениям, которые
+# попали в processing через BLMOVE, но не успели получить срок, он назначается здесь.
+REAP_SCRIPT = """
+local t = redis.call('TIME')
+local now = t[1] * 1000 + math.floor(t[2] / 1000)
+local requeued = 0
+for _, raw in ipairs(redis.call('ZRANGEBYSCORE', KEYS[3], '-inf', now)) do
+    if redis.call('LREM', KEYS[2], 1, raw) > 0 then
+        redis.call('RPUSH', KEYS[1], raw)
+        requeued = requeued + 1
+    end
+    redis.call('ZREM', KEYS[3], raw)
+end
+for _, raw in ipairs(redis.call('LRANGE', KEYS[2], 0, -1)) do
+    if not redis.call('ZSCORE', KEYS[3], raw) then
+        redis.call('ZADD', KEYS[3], now + tonumber(ARGV[1]), raw)
+    end
+end
+return requeued
+"""
+
+
+class Delivery:
+    """Полученное сообщение, которое нужно подтвердить (ack) или вернуть в очередь (nack)"""
+    def __init__(self, queue: 'ReliableRedisQueue', raw: str, receipt: int):
+        self.queue = queue
+        self.raw = raw
+        self.receipt = receipt
+        self.body = json.loads(raw)["body"]
+
+    def ack(self) -> bool:
+        """False - доставка устарела: сообщение уже возвращено в очередь и отдано другому"""
+        return self.queue.ack_script(keys=self.queue.keys, args=[self.raw, self.receipt]) > 0
+
+    def nack(self) -> bool:
+        return self.queue.nack_script(keys=self.queue.keys, args=[self.raw, self.receipt]) > 0
+
+
+class ReliableRedisQueue(RedisQueue):
+    """Очередь с доставкой at-least-once.
+
+    Сообщение не удаляется при получении, а переносится в список {name}:processing
+    и получает срок видимости в {name}:deadlines. ack() удаляет его окончательно,
+    nack() возвращает в очередь, а reap() возвращает сообщения, чей обработчик упал
+    или завис дольше visibility_timeout. Каждое получение выдаёт новую квитанцию
+    ({name}:receipts), и ack/nack по устаревшей квитанции ничего не делают.
+    """
+    def __init__(self, name: str = "queue", visibility_timeout: float = 30, client: redis.Redis = r):
+        super().__init__(name=name, client=client)
+        self.visibility_timeout_ms = int(visibility_timeout * 1000)
+        self.processing = f"{name}:processing"
+        self.deadlines = f"{name}:deadlines"
+        self.receipts = f"{name}:receipts"
+        self.keys = [self.name, self.processing, self.deadlines, self.receipts]
+        self.fetch_script = client.register_script(FETCH_SCRIPT)
+        self.claim_script = client.register_script(CLAIM_SCRIPT)
+        self.ack_script = client.register_script(ACK_SCRIPT)
+        self.nack_script = client.register_script(NACK_SCRIPT)
+        self.reap_script = client.register_script(REAP_SCRIPT)
+
+    @staticmethod
+    def wrap(msg: dict) -> str:
+        # id делает одинаковые сообщения различимыми для LREM в ack/nack
+        return json.dumps({"id": uuid.uuid4().hex, "body": msg})
+
+    def publish(self, msg: dict):
+        self.client.rpush(self.name, self.wrap(msg))
+
+    def publish_many(self, msgs) -> int:
+        return super().publish_many({"id": uuid.uuid4().hex, "body": msg} for msg in msgs)
+
+    def consume(self, block: bool = False, timeout: float = 0) -> Delivery | None:
+        if block:
+            raw = self.client.blmove(self.name, self.processing, timeout, "LEFT", "RIGHT")
+            if raw is None:
+                return None
+            receipt = self.claim_script(keys=self.keys, args=[raw, self.visibility_timeout_ms])
+            return Delivery(self, raw, receipt) if receipt else None
+        deliveries = self.consume_many(count=1)
+        return deliveries[0] if deliveries else None
+
+    def consume_many(self, count: int = BATCH_SIZE, block: bool = False, timeout: float = 0) -> list[Delivery]:
+        raws = self.fetch_script(keys=self.keys, args=[self.visibility_timeout_ms, count])
+        if not raws and block:
+            delivery = self.consume(block=True, timeout=timeout)
+            return [delivery] if delivery else []
+        return [Delivery(self, raw, receipt) for raw, receipt in zip(raws[::2], raws[1::2])]
+
+    def reap(self) -> int:
+        return self.reap_script(keys=self.keys, args=[self.visibility_timeout_ms])
+
+
+class WorkerPool:
+    """Пул потоков, обрабатывающих ReliableRedisQueue.
+
+    concurrency - число потоков-обработчиков, prefetch - сколько сообщений может быть
+    получено, но ещё не подтверждено. Успешно обработанное сообщение подтверждается,
+    при исключении возвращается в очередь. Раз в reap_interval секунд пул возвращает
+    в очередь сообщения упавших потребителей.
+    """
+    def __init__(self, queue: ReliableRedisQueue, handler, concurrency: int = 8,
+                 prefetch: int | None = None, reap_interval: float = 5):
+        self.queue = queue
+        self.handler = handler
+        self.concurrency = concurrency
+        self.prefetch = prefetch or concurrency * 2
+        self.reap_interval = reap_interval
+        self.stopped = threading.Event()
+
+    def process(self, delivery: Delivery, slots: threading.Semaphore) -> None:
+        try:
+            self.handler(delivery.body)
+        except Exception as e:
+            logger.exception(f"Ошибка обработки сообщения: {type(e).__name__} - {e}", exc_info=True)
+            delivery.nack()
+        else:
+            delivery.ack()
+        finally:
+            slots.release()
+
+    def run(self) -> None:
+        slots = threading.Semaphore(self.prefetch)
+        last_reap = 0.0
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            while not self.stopped.is_set():
+                if time.monotonic() - last_reap >= self.reap_interval:
+                    self.queue.reap()
+                    last_reap = time.monotonic()
+
+                if not slots.acquire(timeout=1):
+                    continue
+                free = 1
+                while free < self.prefetch and slots.acquire(blocking=False):
+                    free += 1
+
+                deliveries = self.queue.consume_many(count=free, block=True, timeout=1)
+                for _ in range(free - len(deliveries)):
+                    slots.release()
+                for delivery in deliveries:
+                    executor.submit(self.process, delivery, slots)
+
+    def stop(self) -> None:
+        self.stopped.set()
+
 
 if __name__ == '__main__':
     q = RedisQueue()
@@ -19,4 +274,46 @@ if __name__ == '__main__':
 
     assert q.consume() == {'a': 1}
     assert q.consume() == {'b': 2}
-    assert q.consume() == {'c': 3}
\ No newline at end of file
+    assert q.consume() == {'c': 3}
+    assert q.consume() is None
+    assert q.consume(block=True, timeout=0.1) is None
+
+    assert q.publish_many({'n': i} for i in range(2500)) == 2500
+    received = []
+    while batch := q.consume_many(count=1000):
+        received.extend(batch)
+    assert received == [{'n': i} for i in range(2500)]
+
+    reliable = ReliableRedisQueue("reliable", visibility_timeout=0.2)
+    reliable.publish({'a': 1})
+    delivery = reliable.consume()
+    assert delivery.body == {'a': 1}
+    assert reliable.consume() is None
+    time.sleep(0.3)
+    assert reliable.reap() == 1
+    delivery = reliable.consume()
+    assert delivery.body == {'a': 1}
+    delivery.ack()
+    assert reliable.reap() == 0 and reliable.consume() is None
+
+    # Поздний ack первого потребителя не трогает повторную доставку второму
+    reliable.publish({'a': 2})
+    slow = reliable.consume()
+    time.sleep(0.3)
+    assert reliable.reap() == 1
+    second = reliable.consume()
+    assert not slow.ack()
+    time.sleep(0.3)
+    assert reliable.reap() == 1
+    assert reliable.consume().ack() and not second.ack()
+
+    processed = []
+    reliable.publish_many({'n': i} for i in range(100))
+    pool = WorkerPool(reliable, processed.append, concurrency=4)
+    pool_thread = threading.Thread(target=pool.run)
+    pool_thread.start()
+    while len(processed) < 100:
+        time.sleep(0.05)
+    pool.stop()
+    pool_thread.join()
+    assert sorted(msg['n'] for msg in processed) == list(range(100))
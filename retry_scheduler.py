@@ -0,0 +1,68 @@
+import asyncio
+import email.utils
+import heapq
+import itertools
+import random
+import time
+
+MAX_RETRY_DELAY = 30
+
+
+def backoff_delay(attempt: int, base: float = 1, cap: float = MAX_RETRY_DELAY) -> float:
+    """Экспоненциальная задержка с полным джиттером, чтобы повторы не шли одной волной"""
+    return random.uniform(0, min(cap, base * 2 ** (attempt - 1)))
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Retry-After бывает числом секунд или HTTP-датой"""
+    if not value:
+        return None
+    if value.isdigit():
+        return float(value)
+    try:
+        retry_at = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    return max(0.0, retry_at.timestamp() - time.time())
+
+
+class RetryScheduler:
+    """Очередь отложенных повторов: куча, упорядоченная по времени, когда повтор пора выполнить.
+
+    Consumer не ждёт задержку сам, а отдаёт элемент в schedule() и сразу берёт следующий
+    готовый URL. Для отложенного элемента consumer не вызывает task_done() - это делает
+    планировщик после возврата элемента в очередь, поэтому queue.join() не завершится,
+    пока есть отложенные повторы.
+    """
+    def __init__(self, queue: asyncio.Queue):
+        self.queue = queue
+        self.heap = []
+        self.counter = itertools.count()
+        self.wakeup = asyncio.Event()
+
+    def schedule(self, item, delay: float) -> None:
+        # Слишком большой Retry-After не должен держать весь обход, поэтому задержка ограничена
+        due = asyncio.get_running_loop().time() + min(delay, MAX_RETRY_DELAY)
+        heapq.heappush(self.heap, (due, next(self.counter), item))
+        self.wakeup.set()
+
+    def __len__(self) -> int:
+        return len(self.heap)
+
+    async def run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            self.wakeup.clear()
+            if not self.heap:
+                await self.wakeup.wait()
+                continue
+            delay = self.heap[0][0] - loop.time()
+            if delay > 0:
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), delay)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            _, _, item = heapq.heappop(self.heap)
+            await self.queue.put(item)
+            self.queue.task_done()
@@ -0,0 +1,202 @@
+import argparse
+import asyncio
+import heapq
+import json
+import logging
+import multiprocessing
+import os
+import shutil
+import tempfile
+import time
+import zlib
+from urllib.parse import urlsplit
+
+import fetch_pipeline
+
+logging.basicConfig(
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S"
+)
+
+logger = logging.getLogger(__name__)
+
+PROGRESS_INTERVAL = 1.0
+
+# fork из процесса с работающим event loop и потоками aiofiles небезопасен
+mp_context = multiprocessing.get_context("spawn")
+
+
+def shard_of(url: str, index: int, count_shards: int, by_host: bool) -> int:
+    # crc32, а не hash(): номер шарда не должен меняться между запусками (важно для resume)
+    if by_host:
+        return zlib.crc32(urlsplit(url).netloc.encode()) % count_shards
+    return index % count_shards
+
+
+def iter_urls(file_path: str):
+    with open(file_path) as f:
+        for line in f:
+            url = line.strip()
+            if url:
+                yield url
+
+
+def split_input(read_file_path: str, shard_paths: list, by_host: bool) -> int:
+    files = [open(path, "w") for path in shard_paths]
+    count = 0
+    try:
+        for index, url in enumerate(iter_urls(read_file_path)):
+            files[shard_of(url, index, len(files), by_host)].write(url + "\n")
+            count = index + 1
+    finally:
+        for f in files:
+            f.close()
+    return count
+
+
+def run_shard(handler: str, read_file_path: str, count_consumers: int, write_file_path: str,
+              options: dict) -> None:
+    """Точка входа процесса: свой event loop и свой пул соединений на шард"""
+    asyncio.run(fetch_pipeline.fetch_urls(read_file_path, count_consumers, write_file_path,
+                                          handler=fetch_pipeline.HANDLERS[handler](), **options))
+
+
+class ShardTail:
+    """Читает из выходного файла шарда только дописанные целиком строки"""
+    def __init__(self, path: str):
+        self.path = path
+        self.offset = 0
+
+    def read_lines(self) -> bytes:
+        if not os.path.exists(self.path):
+            return b""
+        with open(self.path, "rb") as f:
+            f.seek(self.offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1
+        self.offset += end
+        return data[:end]
+
+
+def sort_shard(read_file_path: str, shard: int, count_shards: int, by_host: bool,
+               shard_output_path: str, sorted_path: str) -> None:
+    """Упорядочивает результаты шарда по номеру url во входном файле.
+    Записи одного url, встреченного несколько раз, получают его номера по порядку,
+    лишние записи (повтор после продолжения) отбрасываются."""
+    positions = {}
+    for index, url in enumerate(iter_urls(read_file_path)):
+        if shard_of(url, index, count_shards, by_host) == shard:
+            positions.setdefault(url, []).append(index)
+    records = []
+    with open(shard_output_path, "rb") as f:
+        for line in f:
+            url = json.loads(line)["url"]
+            # После продолжения прерванного обхода последняя пачка шарда может повториться
+            if positions[url]:
+                records.append((positions[url].pop(0), line))
+    records.sort(key=lambda record: record[0])
+    with open(sorted_path, "wb") as f:
+        for position, line in records:
+            f.write(b"%d\t" % position + line)
+
+
+def merge_sorted(sorted_paths: list, write_file_path: str) -> None:
+    files = [open(path, "rb") for path in sorted_paths]
+    try:
+        with open(write_file_path, "wb") as out:
+            for line in heapq.merge(*files, key=lambda line: int(line[:line.index(b"\t")])):
+                out.write(line[line.index(b"\t") + 1:])
+    finally:
+        for f in files:
+            f.close()
+
+
+async def fetch_urls_sharded(read_file_path: str, count_processes: int, count_consumers: int,
+                             write_file_path: str, handler: str = "json",
+                             ordered: bool = False, by_host: bool = False,
+                             progress_interval: float = PROGRESS_INTERVAL, **options) -> None:
+    """Делит входной файл на count_processes шардов, каждый обходит отдельный процесс
+    с собственным fetch_pipeline.fetch_urls (count_consumers consumer-ов на процесс), и сливает
+    результаты в write_file_path. handler - имя из fetch_pipeline.HANDLERS: объект
+    обработчика в другой процесс не передаётся, он создаётся в каждом шарде заново.
+
+    ordered=False - строки переносятся в общий файл по мере записи шардами;
+    ordered=True - после завершения шарды упорядочиваются по номеру url во входном файле.
+    by_host=True - все url одного хоста попадают в один шард, и адаптивный предел
+    HostLimiter для хоста остаётся единым; иначе url раздаются по кругу.
+    options передаются в fetch_urls; state_path превращается в state_path.<номер шарда>.
+    С state_path результаты шардов лежат в state_path.shards и удаляются только после
+    успешного завершения: продолжаемый шард дописывает в свой файл, и общий файл
+    собирается заново из полных результатов шардов, а не только из дообойдённых url.
+    """
+    started = time.monotonic()
+    state_path = options.get("state_path")
+    if state_path:
+        shards_dir = f"{state_path}.shards"
+        os.makedirs(shards_dir, exist_ok=True)
+    else:
+        shards_dir = tempfile.mkdtemp(prefix="shards-", dir=os.path.dirname(os.path.abspath(write_file_path)))
+    completed = False
+    try:
+        input_paths = [os.path.join(shards_dir, f"urls.{i}.txt") for i in range(count_processes)]
+        output_paths = [os.path.join(shards_dir, f"results.{i}.jsonl") for i in range(count_processes)]
+        total = split_input(read_file_path, input_paths, by_host)
+
+        processes = []
+        for i in range(count_processes):
+            shard_options = dict(options)
+            if shard_options.get("state_path"):
+                shard_options["state_path"] = f"{shard_options['state_path']}.{i}"
+            process = mp_context.Process(
+                target=run_shard,
+                args=(handler, input_paths[i], count_consumers, output_paths[i], shard_options),
+                daemon=True
+            )
+            process.start()
+            processes.append(process)
+
+        tails = [ShardTail(path) for path in output_paths]
+        written = 0
+        with open(write_file_path, "wb") as out:
+            while True:
+                alive = sum(process.is_alive() for process in processes)
+                for tail in tails:
+                    data = tail.read_lines()
+                    written += data.count(b"\n")
+                    if not ordered:
+                        out.write(data)
+                elapsed = time.monotonic() - started
+                logger.info(f"Шарды: работают {alive}/{count_processes}, результатов {written} из {total} url, "
+                            f"{written / elapsed:.0f} в секунду")
+                if not alive:
+                    break
+                await asyncio.sleep(progress_interval)
+
+        failed = [i for i, process in enumerate(processes) if process.exitcode != 0]
+        if failed:
+            raise RuntimeError(f"Shards {failed} exited with errors")
+
+        if ordered:
+            sorted_paths = [path + ".sorted" for path in output_paths]
+            for i in range(count_processes):
+                sort_shard(read_file_path, i, count_processes, by_host, output_paths[i], sorted_paths[i])
+            merge_sorted(sorted_paths, write_file_path)
+        completed = True
+    finally:
+        if completed or not state_path:
+            shutil.rmtree(shards_dir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    logger.setLevel(logging.INFO)
+    parser = argparse.ArgumentParser()
+    parser.add_argument("urls", nargs="?", default="./urls.txt")
+    parser.add_argument("results", nargs="?", default="./results.jsonl")
+    parser.add_argument("--processes", type=int, default=os.cpu_count())
+    parser.add_argument("--consumers", type=int, default=10)
+    parser.add_argument("--handler", choices=sorted(fetch_pipeline.HANDLERS), default="json")
+    parser.add_argument("--ordered", action="store_true")
+    parser.add_argument("--by-host", action="store_true")
+    args = parser.parse_args()
+    asyncio.run(fetch_urls_sharded(args.urls, args.processes, args.consumers, args.results,
+                                   handler=args.handler, ordered=args.ordered, by_host=args.by_host))
@@ -0,0 +1,170 @@
+import functools
+import hashlib
+import json
+import logging
+import threading
+import time
+import redis
+
+from lru_cache import lru_cache
+
+logging.basicConfig(
+    format="%(asctime)s [%(levelname)s] %(message)s",
+    datefmt="%Y-%m-%d %H:%M:%S"
+)
+
+logger = logging.getLogger(__name__)
+
+# Без decode_responses: сериализатор сам решает, как читать байты (json, pickle, ...)
+r = redis.Redis(host='localhost', port=6379, db=0)
+
+INVALIDATION_CHANNEL = "cache:invalidate"
+
+
+class InvalidationListener:
+    """Один подписчик на процесс: получает ключи из канала и сбрасывает их в локальных кэшах"""
+    def __init__(self, client: redis.Redis):
+        self.client = client
+        self.local_caches = {}
+        self.lock = threading.Lock()
+        self.thread = None
+
+    def register(self, prefix: str, discard) -> None:
+        with self.lock:
+            self.local_caches[prefix] = discard
+
+    def ensure_started(self) -> None:
+        # Подписка откладывается до первого промаха, чтобы импорт не требовал redis
+        if self.thread is not None:
+            return
+        with self.lock:
+            if self.thread is None:
+                pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+                pubsub.subscribe(**{INVALIDATION_CHANNEL: self.handle})
+                self.thread = pubsub.run_in_thread(sleep_time=1, daemon=True)
+
+    def handle(self, message: dict) -> None:
+        cache_key = message["data"]
+        if isinstance(cache_key, bytes):
+            cache_key = cache_key.decode()
+        prefix = cache_key.rpartition(":")[0]
+        discard = self.local_caches.get(prefix)
+        if discard is not None:
+            discard(cache_key)
+
+
+_listeners = {}
+_listeners_lock = threading.Lock()
+
+
+def _get_listener(client: redis.Redis) -> InvalidationListener:
+    with _listeners_lock:
+        listener = _listeners.get(id(client))
+        if listener is None:
+            listener = _listeners[id(client)] = InvalidationListener(client)
+        return listener
+
+
+def two_tier_cache(maxsize: int = 128,
+                   ttl: int | None = None,
+                   serializer=json,
+                   client: redis.Redis = r):
+    """Локальный lru_cache перед общим redis.
+
+    Локальное попадание не выходит из процесса. При промахе сначала читается redis,
+    и только потом вызывается функция; результат записывается в redis (write-through).
+    invalidate() удаляет ключ из redis и через pub/sub сбрасывает его во всех процессах.
+    Значение, прочитанное из redis, хранится локально не дольше оставшегося у ключа PTTL,
+    поэтому локальная копия не переживает общую. Если во время промаха пришла любая
+    инвалидация этой функции, прочитанное значение отдаётся вызывающему, но в локальный
+    кэш не попадает: иначе сброс мог бы обогнать запись, и устаревшая копия осталась бы.
+    serializer - любой объект с dumps/loads (json, pickle, ...).
+    """
+    def decorator(func):
+        prefix = f"cache:{func.__module__}.{func.__qualname__}"
+        listener = _get_listener(client)
+
+        def make_key(args, kwargs) -> str:
+            raw = json.dumps([args, kwargs], sort_keys=True, default=repr)
+            return f"{prefix}:{hashlib.sha1(raw.encode()).hexdigest()}"
+
+        # Счётчик инвалидаций функции. Промах запоминает его до чтения redis, а lru_cache
+        # проверяет при записи под своей блокировкой: счётчик растёт раньше, чем сбрасывается
+        # ключ, поэтому запись либо успевает до сброса и удаляется им, либо не делается
+        invalidations = {"count": 0}
+        invalidations_lock = threading.Lock()
+
+        def entry_ttl(entry):
+            result, seconds, seen_invalidations = entry
+            return seconds if seen_invalidations == invalidations["count"] else 0
+
+        # Локальный кэш хранит (результат, время жизни в секундах или None, счётчик инвалидаций)
+        @lru_cache(maxsize=maxsize, key=make_key, ttl=entry_ttl)
+        def fetch_entry(*args, **kwargs):
+            cache_key = make_key(args, kwargs)
+            seen_invalidations = invalidations["count"]
+            try:
+                listener.ensure_started()
+                pipe = client.pipeline()
+                pipe.get(cache_key)
+                pipe.pttl(cache_key)
+                raw, pttl = pipe.execute()
+            except redis.RedisError as e:
+                logger.warning(f"Redis недоступен, вычисляем локально: {type(e).__name__} - {e}")
+                return func(*args, **kwargs), ttl, seen_invalidations
+
+            if raw is not None:
+                # pttl -1 - у ключа нет срока (записан без ttl)
+                return serializer.loads(raw), pttl / 1000 if pttl > 0 else ttl, seen_invalidations
+
+            result = func(*args, **kwargs)
+            try:
+                client.set(cache_key, serializer.dumps(result), ex=ttl)
+            except redis.RedisError as e:
+                logger.warning(f"Не удалось записать в redis: {type(e).__name__} - {e}")
+            return result, ttl, seen_invalidations
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            return fetch_entry(*args, **kwargs)[0]
+
+        def discard(cache_key: str) -> None:
+            with invalidations_lock:
+                invalidations["count"] += 1
+            fetch_entry.cache_discard(cache_key)
+
+        def invalidate(*args, **kwargs) -> None:
+            cache_key = make_key(args, kwargs)
+            # Сначала удаляем из redis: промах, начатый после локального сброса, не должен
+            # успеть прочитать там старое значение
+            try:
+                pipe = client.pipeline()
+                pipe.delete(cache_key)
+                pipe.publish(INVALIDATION_CHANNEL, cache_key)
+                pipe.execute()
+            finally:
+                discard(cache_key)
+
+        wrapper.cache_discard = discard
+        wrapper.cache_info = fetch_entry.cache_info
+        wrapper.cache_clear = fetch_entry.cache_clear
+        wrapper.invalidate = invalidate
+        listener.register(prefix, wrapper.cache_discard)
+        return wrapper
+    return decorator
+
+
+@two_tier_cache(maxsize=256, ttl=60)
+def slow_square(x: int) -> int:
+    time.sleep(1)
+    return x * x
+
+
+if __name__ == '__main__':
+    t = time.perf_counter()
+    assert slow_square(4) == 16
+    assert slow_square(4) == 16
+    print(f"Два вызова: {time.perf_counter() - t:.2f} c")
+
+    slow_square.invalidate(4)
+    assert slow_square(4) == 16